@@ -0,0 +1,181 @@
+"""
+Benchmark of the desk worker loop against a simulated desk.
+
+    python benchmarks/worker_loop.py calibration
+    python benchmarks/worker_loop.py wakeups
+    python benchmarks/worker_loop.py replay [--trace idasen-ui-trace.bin --target 0.9]
+
+calibration: preset accuracy before and after the desk calibration.
+wakeups: idle wakeups per hour of the worker loop against a fixed interval.
+replay: motion control replayed from a BLE trace, recorded on the simulated
+desk unless one is given, checked against the recorded writes.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "idasen-ui"))
+
+from idasen_desk import DeskWorkerThread  # noqa: E402
+from idasen_desk import IdasenDesk  # noqa: E402
+from idasen_desk import PollingPolicy  # noqa: E402
+from idasen_desk import ReplayClient  # noqa: E402
+from idasen_desk import SimulatedClient  # noqa: E402
+from idasen_desk import _TRACE_WRITE  # noqa: E402
+from idasen_desk import read_trace  # noqa: E402
+
+MAC = "AA:AA:AA:AA:AA:AA"
+
+
+def start_worker(client: SimulatedClient) -> DeskWorkerThread:
+    worker = DeskWorkerThread()
+    worker.connect(MAC, client=client)
+    worker.start_running_loop()
+    while worker.state.height == 0.0:
+        time.sleep(0.01)
+    return worker
+
+
+def stop_worker(worker: DeskWorkerThread):
+    worker.stop_running_loop()
+    worker.join()
+
+
+def wait_for_moves(worker: DeskWorkerThread, count: int):
+    while len(worker.move_stats) < count:
+        time.sleep(0.01)
+
+
+def run_presets(worker: DeskWorkerThread, targets) -> list:
+    """ Move to each target in turn, returns ``(error, commands, seconds)`` per move. """
+    results = []
+    for target in targets:
+        done = len(worker.move_stats)
+        start = time.monotonic()
+        worker.move_to_height(target)
+        wait_for_moves(worker, done + 1)
+        _, error, commands = worker.move_stats[-1]
+        results.append((error, commands, time.monotonic() - start))
+    return results
+
+
+def report(name: str, results: list):
+    errors = [abs(error) * 1000 for error, _, _ in results]
+    print(
+        f"{name:<14} mean |error| {statistics.mean(errors):5.1f} mm   "
+        f"max {max(errors):5.1f} mm   "
+        f"commands {statistics.mean(commands for _, commands, _ in results):4.1f}   "
+        f"duration {statistics.mean(seconds for _, _, seconds in results):4.2f} s"
+    )
+
+
+def bench_calibration(args):
+    client = SimulatedClient(height=0.8, coast=args.coast)
+    targets = [0.9, 0.8] * args.moves
+    print(f"simulated desk: {client.speed * 1000:.0f} mm/s, {client.latency:.2f} s latency, "
+          f"{client.coast * 1000:.0f} mm coast, {len(targets)} presets of 100 mm")
+    worker = start_worker(client)
+    try:
+        report("uncalibrated", run_presets(worker, targets))
+        done = len(worker.move_stats)
+        worker.calibrate(0.1)
+        wait_for_moves(worker, done + 2)
+        report("calibrated", run_presets(worker, targets))
+        calibration = worker.idasen_desk.calibration
+        print(f"learned: up {calibration.up_speed * 1000:.1f} mm/s, {calibration.up_coast * 1000:.1f} mm coast, "
+              f"down {calibration.down_speed * 1000:.1f} mm/s, {calibration.down_coast * 1000:.1f} mm coast")
+    finally:
+        stop_worker(worker)
+
+
+def idle_wakeups(polling: PollingPolicy, seconds: float, scale: float) -> float:
+    """ Wakeups per hour of a worker left idle, its time running ``scale`` times faster. """
+    worker = start_worker(SimulatedClient(round_trip=0.001))
+    worker.polling = polling
+    try:
+        wakeups = worker.wakeups
+        time.sleep(seconds)
+        return (worker.wakeups - wakeups) * 3600 / (seconds * scale)
+    finally:
+        stop_worker(worker)
+
+
+def bench_wakeups(args):
+    scale = args.scale
+    print(f"desk at rest for {args.seconds * scale:.0f} simulated seconds ({scale:.0f}x faster)")
+    legacy = idle_wakeups(PollingPolicy(0.5 / scale, 0.5 / scale, 1.0), args.seconds, scale)
+    backoff = idle_wakeups(PollingPolicy(0.5 / scale, 30.0 / scale), args.seconds, scale)
+    print(f"fixed 0.5 s loop   {legacy:7.0f} wakeups per hour")
+    print(f"backoff to 30 s    {backoff:7.0f} wakeups per hour")
+
+
+def move(desk: IdasenDesk, target: float):
+    async def scenario():
+        async with desk:
+            return await desk.move_to_target(target)
+
+    return asyncio.run(scenario())
+
+
+def bench_replay(args):
+    if args.trace is not None:
+        replay_trace(args.trace, args)
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "idasen-ui-trace.bin")
+        client = SimulatedClient(height=0.8, coast=0.02, round_trip=0.02)
+        recorded = move(IdasenDesk(MAC, client=client, trace_path=path), args.target)
+        print(f"recorded on the simulated desk: {recorded}")
+        replay_trace(path, args)
+
+
+def replay_trace(path: str, args):
+    """ Replay the move recorded in ``path``, exits with status 1 if any replay differs. """
+    writes = [payload for seconds, kind, uuid_index, payload in read_trace(path) if kind == _TRACE_WRITE]
+    durations = []
+    results = set()
+    matching = 0
+    for _ in range(args.runs):
+        client = ReplayClient(path, speed=args.speed)
+        start = time.perf_counter()
+        result = move(IdasenDesk(MAC, client=client), args.target)
+        durations.append(time.perf_counter() - start)
+        results.add((result.reason, round(result.height, 4), result.commands, result.samples))
+        matching += [payload for seconds, uuid, payload in client.writes] == writes
+    reason, height, commands, samples = next(iter(results))
+    print(f"replayed {args.runs} times at speed {args.speed:g}: {reason} at {height:.3f}, "
+          f"{commands} commands, {samples} samples")
+    print(f"per replay {statistics.mean(durations) * 1000:7.2f} ms   "
+          f"per sample {statistics.mean(durations) / samples * 1e6:6.1f} us")
+    print(f"identical results {len(results) == 1}   writes matching the trace {matching}/{args.runs}")
+    if len(results) != 1 or matching != args.runs:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    calibration = subparsers.add_parser("calibration", help="preset accuracy before and after calibration")
+    calibration.add_argument("--coast", type=float, default=0.02, help="meters the simulated desk coasts")
+    calibration.add_argument("--moves", type=int, default=2, help="round trips measured before and after")
+    calibration.set_defaults(run=bench_calibration)
+    wakeups = subparsers.add_parser("wakeups", help="idle wakeups against the fixed 0.5 s loop")
+    wakeups.add_argument("--seconds", type=float, default=30.0, help="seconds each loop is left idle")
+    wakeups.add_argument("--scale", type=float, default=20.0, help="speed up of the polling intervals")
+    wakeups.set_defaults(run=bench_wakeups)
+    replay = subparsers.add_parser("replay", help="motion control replayed from a BLE trace")
+    replay.add_argument("--trace", help="trace to replay, recorded on the simulated desk if not given")
+    replay.add_argument("--target", type=float, default=0.9, help="target height of the recorded move")
+    replay.add_argument("--runs", type=int, default=20, help="number of replays")
+    replay.add_argument("--speed", type=float, default=0.0, help="replay speed, 0 as fast as possible")
+    replay.set_defaults(run=bench_replay)
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
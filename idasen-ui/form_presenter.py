@@ -0,0 +1,116 @@
+# IDASEN UI - MAIN FORM PRESENTER
+# UI logic of MyForm without any wx dependency, so it runs and is tested headless.
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from idasen_desk import DeskState
+
+#==========================================================================
+# DeskFormPresenter class holds the UI logic of MyForm
+#==========================================================================
+class DeskFormPresenter:
+    """
+    UI state machine of the main form, free of wx so it can run headless.
+
+    Each event method returns the widget updates to apply as
+    ``{widget: {attribute: value}}``, where attributes are ``bitmap``,
+    ``enabled`` and ``label``. Widgets and attributes that did not change are
+    left out, so the renderer only touches what the transition modified.
+
+    The height saved in memory mode is read when M is pressed: idle polling
+    may have backed off long before and missed a move made with the desk
+    switch.
+
+    Args:
+        desk: Desk worker receiving the move commands.
+        get_position: Returns the saved height of a position name.
+        save_position: Saves a height under a position name.
+    """
+
+    #: Seconds a position save waits for the height read when M was pressed.
+    REFRESH_TIMEOUT: float = 2.0
+
+    def __init__(
+        self,
+        desk,
+        get_position: Callable[[str], float],
+        save_position: Callable[[str, float], None],
+    ):
+        self._desk = desk
+        self._get_position = get_position
+        self._save_position = save_position
+        self.connected = False
+        self.memory_mode = False
+        self.height: Optional[float] = None
+        # snapshot version the saved height has to be newer than
+        self._memory_version = 0
+        # matches the widgets as MyForm creates them
+        self._widgets: Dict[str, Dict[str, object]] = self._view()
+
+    def widget(self, name: str) -> Dict[str, object]:
+        """ Current attributes of a widget. """
+        return dict(self._widgets[name])
+
+    def _view(self) -> Dict[str, Dict[str, object]]:
+        suffix = "" if self.connected else "-nc"
+        active = self.connected and not self.memory_mode
+        position_suffix = "-h" if self.memory_mode else suffix
+        height = f"{self.height:.2f}" if self.connected and self.height is not None else "N/A"
+        return {
+            "bluetooth": {"bitmap": f"bt{suffix}.png", "enabled": not self.connected},
+            "height": {"label": height, "enabled": False},
+            "up": {"bitmap": f"up{suffix}.png", "enabled": active},
+            "down": {"bitmap": f"down{suffix}.png", "enabled": active},
+            "pos1": {"bitmap": f"pos1{position_suffix}.png", "enabled": self.connected},
+            "pos2": {"bitmap": f"pos2{position_suffix}.png", "enabled": self.connected},
+            "memory": {"bitmap": f"m{suffix}.png", "enabled": self.connected},
+        }
+
+    def _changes(self) -> Dict[str, Dict[str, object]]:
+        changes = {}
+        for name, attributes in self._view().items():
+            current = self._widgets[name]
+            diff = {key: value for key, value in attributes.items() if current.get(key) != value}
+            if diff:
+                current.update(diff)
+                changes[name] = diff
+        return changes
+
+    def connected_changed(self, connected: bool) -> Dict[str, Dict[str, object]]:
+        self.connected = connected
+        if not connected:
+            self.memory_mode = False
+            self.height = None
+        return self._changes()
+
+    def height_changed(self, height: float) -> Dict[str, Dict[str, object]]:
+        self.height = height
+        return self._changes()
+
+    def memory_pressed(self) -> Dict[str, Dict[str, object]]:
+        if self.connected:
+            self.memory_mode = not self.memory_mode
+            if self.memory_mode:
+                self._memory_version = self._desk.refresh()
+        return self._changes()
+
+    def position_pressed(self, name: str) -> Dict[str, Dict[str, object]]:
+        """ Save the current height under ``name`` in memory mode, move to it otherwise. """
+        if not self.connected:
+            return {}
+        if self.memory_mode:
+            self.memory_mode = False
+            # usually read long ago, otherwise one BLE round trip away
+            state = self._desk.wait_for_state(self._memory_version, timeout=self.REFRESH_TIMEOUT)
+            self._save_position(name, state.height)
+        else:
+            self._desk.move_to_height(self._get_position(name))
+        return self._changes()
+
+    def manual_pressed(self, direction: int):
+        if self.connected and not self.memory_mode:
+            self._desk.manual_direction = direction
+
+    def manual_released(self):
+        self._desk.manual_direction = DeskState.IDLE
@@ -0,0 +1,269 @@
+# IDASEN UI - CONFIGURATION
+# Loading, migration, validation and saving of the user config file.
+# Nothing in here imports wx, so it runs and is tested headless; the yaml
+# loader is only imported when the cached config cannot be used.
+import copy
+import logging
+import marshal
+import os
+import shutil
+import tempfile
+
+import voluptuous as vol
+
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from idasen_desk import IdasenDesk
+
+_logger = logging.getLogger("idasen-ui")
+
+#==========================================================================
+# GLOBAL VARIABLES
+#==========================================================================
+CONFIG_DIRECTORY = os.path.join(os.path.expanduser("~"), ".config", "idasen-ui")
+CONFIG_PATH = os.path.join(CONFIG_DIRECTORY, "idasen-ui.yaml")
+
+# Config format version, bumped with every new migration
+CONFIG_VERSION = 2
+
+DEFAULT_CONFIG = {
+    "version": CONFIG_VERSION,
+    "mac_address": "AA:AA:AA:AA:AA:AA",
+    "positions": {"pos2": 1.1, "pos1": 0.70},
+    "always_on_top": 0,
+    "log_to_file": 0,
+    "minimize_to_tray": 0,
+    "record_ble_trace": 0,
+    "calibration": {},
+    "mqtt_broker": "",
+    "profiling": 0,
+}
+
+CONFIG_SCHEMA = vol.Schema(
+    {
+        "mac_address": vol.All(str, vol.Length(min=17, max=17)),
+        "positions": {
+            str: vol.All(
+                vol.Any(float, int),
+                vol.Range(min=IdasenDesk.MIN_HEIGHT, max=IdasenDesk.MAX_HEIGHT),
+            )
+        },
+        "always_on_top": vol.All(int),
+        "log_to_file": vol.All(int),
+        "minimize_to_tray": vol.All(int),
+        "record_ble_trace": vol.All(int),
+        "calibration": {str: {str: vol.Any(float, int)}},
+        "mqtt_broker": str,
+        "profiling": vol.All(int),
+        "version": int,
+    },
+    extra=False,
+)
+
+# Ordered (version, migration) pairs, see _config_migration
+_CONFIG_MIGRATIONS: List[Tuple[int, Callable[[dict], None]]] = []
+
+# Shows config errors to the user, see set_error_reporter
+_error_reporter: Optional[Callable[[str], None]] = None
+
+
+def set_error_reporter(reporter: Optional[Callable[[str], None]]):
+    """ Show config errors to the user with ``reporter``, they are logged in any case. """
+    global _error_reporter
+    _error_reporter = reporter
+
+
+def _config_migration(version: int):
+    """ Register a function upgrading a config, in place, to ``version``. """
+    def register(migration: Callable[[dict], None]):
+        _CONFIG_MIGRATIONS.append((version, migration))
+        _CONFIG_MIGRATIONS.sort(key=lambda entry: entry[0])
+        return migration
+    return register
+
+
+@_config_migration(1)
+def _migrate_unversioned_config(config: dict):
+    # files written before versioning lack the settings added over time
+    for key in ("always_on_top", "log_to_file", "minimize_to_tray", "record_ble_trace", "calibration", "mqtt_broker"):
+        config.setdefault(key, copy.deepcopy(DEFAULT_CONFIG[key]))
+
+
+@_config_migration(2)
+def _add_profiling_setting(config: dict):
+    config.setdefault("profiling", 0)
+
+
+def migrate_config(config: dict) -> bool:
+    """
+    Upgrade a config to the current version in one pass, in memory.
+
+    Returns:
+        ``True`` if any migration was applied.
+    """
+    version = config.get("version", 0)
+    migrated = False
+    for target, migration in _CONFIG_MIGRATIONS:
+        if target > version:
+            migration(config)
+            config["version"] = version = target
+            migrated = True
+    return migrated
+
+
+def _report_config_error(msg: str):
+    _logger.warning(msg)
+    if _error_reporter is not None:
+        _error_reporter(msg)
+
+
+def _config_entries(value) -> int:
+    # settings, nested ones included, each repair removes or resets one of them
+    if not isinstance(value, dict):
+        return 1
+    return 1 + sum(_config_entries(entry) for entry in value.values())
+
+
+def _repair_config(config: dict, path: list) -> bool:
+    # reset the invalid entry to its default, or drop it if it has none
+    parent = config
+    default = DEFAULT_CONFIG
+    for key in path[:-1]:
+        parent = parent.get(key) if isinstance(parent, dict) else None
+        default = default.get(key) if isinstance(default, dict) else None
+    key = path[-1]
+    if not isinstance(parent, dict) or key not in parent:
+        return False
+    if isinstance(default, dict) and key in default:
+        parent[key] = copy.deepcopy(default[key])
+    else:
+        del parent[key]
+    return True
+
+
+def _validate_config(config: dict) -> Tuple[dict, bool]:
+    """ Validate a config, replacing invalid or missing settings by their default. """
+    repaired = False
+    for key, value in DEFAULT_CONFIG.items():
+        if key not in config:
+            config[key] = copy.deepcopy(value)
+            repaired = True
+    for _ in range(_config_entries(config)):
+        try:
+            return CONFIG_SCHEMA(config), repaired
+        except vol.Invalid as e:
+            _report_config_error(f"Invalid configuration: {e}")
+            if not e.path or not _repair_config(config, e.path):
+                break
+            repaired = True
+    return copy.deepcopy(DEFAULT_CONFIG), True
+
+
+def _config_signature(path: str) -> Tuple[str, int, int]:
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def _config_cache_path(path: str) -> str:
+    return os.path.splitext(path)[0] + ".cache"
+
+
+def _read_config_cache(path: str) -> Optional[dict]:
+    # the snapshot is only valid for the exact yaml file it was made from
+    try:
+        with open(_config_cache_path(path), "rb") as f:
+            signature, version, config = marshal.load(f)
+        if version == CONFIG_VERSION and tuple(signature) == _config_signature(path):
+            return config
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+    return None
+
+
+def _replace_file(path: str, mode: str, write: Callable):
+    # write aside and swap, an interrupted save never leaves a truncated file, and
+    # the GUI and worker threads saving together never share a temporary file
+    f = tempfile.NamedTemporaryFile(
+        mode, dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False
+    )
+    try:
+        with f:
+            write(f)
+        os.replace(f.name, path)
+    except BaseException:
+        try:
+            os.remove(f.name)
+        except OSError:
+            pass
+        raise
+
+
+def _write_config_cache(config: dict, path: str):
+    try:
+        _replace_file(
+            _config_cache_path(path),
+            "wb",
+            lambda f: marshal.dump((_config_signature(path), CONFIG_VERSION, config), f),
+        )
+    except (OSError, ValueError) as e:
+        _logger.info(f"Unable to cache config: {e}")
+
+
+def save_config(config: dict, path: str = CONFIG_PATH):
+    import yaml
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _replace_file(path, "w", lambda f: yaml.dump(config, f))
+    _write_config_cache(config, path)
+
+
+def load_config(path: str = CONFIG_PATH) -> dict:
+    """
+    Load user config.
+
+    A binary snapshot of the last validated config is used while the yaml
+    file is unchanged, the yaml loader is only imported otherwise. Old files
+    are migrated and invalid settings reset to their default, then the file
+    is written back once.
+    """
+    print(f"Loading config from: {path}")
+    config = _read_config_cache(path)
+    if config is not None:
+        return config
+
+    import yaml
+    try:
+        with open(path, "r") as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+    except FileNotFoundError:
+        print("Config file not found: creating default config file")
+        config = copy.deepcopy(DEFAULT_CONFIG)
+        save_config(config, path)
+        return config
+    except yaml.YAMLError as e:
+        # the defaults are written over it, keep what the user had for them to fix
+        try:
+            shutil.copyfile(path, path + ".bad")
+            _report_config_error(f"Unable to read configuration, saved as {path}.bad: {e}")
+        except OSError as copy_error:
+            _report_config_error(f"Unable to read configuration: {e} ({copy_error})")
+        config = None
+    if not isinstance(config, dict):
+        config = {}
+
+    migrated = migrate_config(config)
+    config, repaired = _validate_config(config)
+    if migrated or repaired:
+        save_config(config, path)
+    else:
+        _write_config_cache(config, path)
+    return config
+
+
+def save_calibration(mac: str, calibration: dict):
+    # called from the worker thread
+    saved = load_config()
+    saved["calibration"][mac] = calibration
+    save_config(saved)
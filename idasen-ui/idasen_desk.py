@@ -0,0 +1,1783 @@
+# IDASEN UI - DESK CONTROL
+# Desk protocol, motion control and the worker thread driving the desk.
+# Nothing in here imports wx, so it runs and is tested headless; bleak is
+# only imported when connecting to a real desk.
+import asyncio
+import cProfile
+import json
+import logging
+import math
+import os
+import queue
+import sys
+import struct
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from typing import Callable
+from typing import List
+from typing import TYPE_CHECKING
+from threading import Condition
+from threading import Lock
+from threading import Thread
+from threading import current_thread
+from threading import get_ident
+
+if TYPE_CHECKING:
+    from mqtt_bridge import MqttBridge
+
+_logger = logging.getLogger("idasen-ui")
+
+
+def log(msg):
+    _logger.info(msg)
+
+#==========================================================================
+# GLOBAL VARIABLES
+#==========================================================================
+_UUID_HEIGHT: str = "99fa0021-338a-1024-8a49-009c0215f78a"
+_UUID_COMMAND: str = "99fa0002-338a-1024-8a49-009c0215f78a"
+_UUID_REFERENCE_INPUT: str = "99fa0031-338a-1024-8a49-009c0215f78a"
+
+_COMMAND_REFERENCE_INPUT_STOP: bytearray = bytearray([0x01, 0x80])
+_COMMAND_UP: bytearray = bytearray([0x47, 0x00])
+_COMMAND_DOWN: bytearray = bytearray([0x46, 0x00])
+_COMMAND_STOP: bytearray = bytearray([0xFF, 0x00])
+
+# Seconds between repeated move commands while moving to a target
+_MOVE_COMMAND_INTERVAL = 0.4
+
+#==========================================================================
+# MotionClaim class, ownership token handed out by IdasenDesk.acquire_motion
+#==========================================================================
+class MotionClaim:
+    """ Ownership of desk motion held by one command source. """
+
+    __slots__ = ("owner", "priority", "cancelled_at", "observed")
+
+    def __init__(self, owner: str, priority: int):
+        self.owner = owner
+        self.priority = priority
+        #: Monotonic time at which the claim was preempted, ``None`` while active.
+        self.cancelled_at: Optional[float] = None
+        self.observed = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancelled_at is not None
+
+
+#: Claim of callers not taking part in arbitration, it is never cancelled.
+UNARBITRATED = MotionClaim("unarbitrated", -1)
+
+#==========================================================================
+# IdasenDesk class that works with bleak to connect to desk
+# height calculation offset in meters, assumed to be the same for all desks
+#==========================================================================
+class IdasenDesk:
+    """
+    Idasen desk.
+
+    Args:
+        mac: Bluetooth MAC address of the desk.
+        exit_on_fail: If set to True, failing to connect will call ``sys.exit(1)``,
+            otherwise the exception will be raised.
+        client: Transport to use instead of a ``BleakClient``, such as a
+            :class:`ReplayClient`. If it has a ``monotonic()`` method, it is
+            the clock of the motion control instead of ``time.monotonic``.
+        trace_path: If set, every BLE write, read and notification is recorded
+            to this file by a :class:`TraceRecorder`.
+
+    Note:
+        Movement is arbitrated: every command source claims the desk with
+        :meth:`acquire_motion` and a priority (stop > manual > preset > schedule).
+        A new claim cancels the claim it supersedes and writes made on behalf of
+        a cancelled claim are dropped, so only one source drives the motor.
+
+    Example:
+        Basic Usage::
+
+            from idasen import IdasenDesk
+
+
+            async with IdasenDesk(mac="AA:AA:AA:AA:AA:AA") as desk:
+                # call methods here...
+    """
+    #: Minimum desk height in meters.
+    MIN_HEIGHT: float = 0.62
+
+    #: Maximum desk height in meters.
+    MAX_HEIGHT: float = 1.27
+
+    #: Number of times to retry upon failure to connect.
+    RETRY_COUNT: int = 3
+
+    #: Motion priorities, a claim preempts any claim of the same or lower priority.
+    PRIORITY_SCHEDULE: int = 0
+    PRIORITY_PRESET: int = 1
+    PRIORITY_MANUAL: int = 2
+    PRIORITY_STOP: int = 3
+
+    #: Preemption latency in seconds above which a warning is logged.
+    MAX_PREEMPTION_LATENCY: float = 0.5
+
+    #: Filtered speed in meters per second under which the desk is considered stalled.
+    STALL_VELOCITY: float = 0.005
+
+    #: Seconds the desk may stay stalled before move_to_target gives up.
+    STALL_TIMEOUT: float = 3.0
+
+    def __init__(
+        self,
+        mac: str,
+        exit_on_fail: bool = False,
+        client=None,
+        trace_path: Optional[str] = None,
+    ):
+        self._logger = _DeskLoggingAdapter(
+            logger=logging.getLogger(__name__), extra={"mac": mac}
+        )
+        self._mac = mac
+        self._exit_on_fail = exit_on_fail
+        if client is None:
+            from bleak import BleakClient
+            client = BleakClient(self._mac)
+        self._client = client
+        if trace_path is not None:
+            self._client = TraceRecorder(self._client, trace_path)
+        #: Clock timing height samples and moves, in seconds.
+        self.monotonic: Callable[[], float] = getattr(self._client, "monotonic", time.monotonic)
+        self._motion_lock = Lock()
+        self._motion_claim: Optional[MotionClaim] = None
+        self.preemption_latencies: deque = deque(maxlen=100)
+        self.height_filter = HeightFilter()
+        self.calibration = DeskCalibration()
+
+    async def __aenter__(self):
+        await self._connect()
+        return self
+
+    async def __aexit__(self, *args, **kwargs) -> Optional[bool]:
+        return await self._client.__aexit__(*args, **kwargs)
+
+    async def _connect(self):
+        i = 0
+        while True:
+            try:
+                await self._client.__aenter__()
+                return
+            except Exception:
+                if i >= self.RETRY_COUNT:
+                    self._logger.critical("Connection failed")
+                    if self._exit_on_fail:
+                        sys.exit(1)
+                    raise
+                i += 1
+                self._logger.warning(
+                    f"Failed to connect, retrying ({i}/{self.RETRY_COUNT})..."
+                )
+                time.sleep(0.3 * i)
+
+    async def is_connected(self) -> bool:
+        """
+        Check connection status of the desk.
+
+        Returns:
+            Boolean representing connection status.
+
+        >>> async def example() -> bool:
+        ...     async with IdasenDesk(mac="AA:AA:AA:AA:AA:AA") as desk:
+        ...         return await desk.is_connected()
+        >>> asyncio.run(example())
+        True
+        """
+        return await self._client.is_connected()
+
+    @property
+    def mac(self) -> str:
+        """ Desk MAC address. """
+        return self._mac
+
+    @property
+    def motion_owner(self) -> Optional[str]:
+        """ Name of the command source currently owning desk motion. """
+        claim = self._motion_claim
+        return claim.owner if claim is not None else None
+
+    def acquire_motion(self, owner: str, priority: int) -> Optional[MotionClaim]:
+        """
+        Claim ownership of desk motion.
+
+        The claim is granted when the desk is idle or owned by a source of the
+        same or a lower priority, in which case the previous claim is cancelled.
+        This method is thread safe.
+
+        Args:
+            owner: Name of the command source, used for logging.
+            priority: One of the ``PRIORITY_*`` levels.
+
+        Returns:
+            The granted claim, ``None`` if a higher priority source owns the desk.
+        """
+        with self._motion_lock:
+            current = self._motion_claim
+            if current is not None and current.priority > priority:
+                self._logger.info(f"{owner} refused, desk is owned by {current.owner}")
+                return None
+            if current is not None:
+                current.cancelled_at = time.monotonic()
+                self._logger.debug(f"{owner} preempts {current.owner}")
+            self._motion_claim = MotionClaim(owner, priority)
+            return self._motion_claim
+
+    def release_motion(self, claim: Optional[MotionClaim]):
+        """ Release a claim returned by :meth:`acquire_motion`, if still active. """
+        with self._motion_lock:
+            if claim is not None and self._motion_claim is claim:
+                self._motion_claim = None
+
+    def check_preempted(self, claim: Optional[MotionClaim]) -> bool:
+        """
+        Check whether a claim was superseded by another command source.
+
+        The first time a preempted claim is observed, the delay between the
+        preemption and its observation is recorded in ``preemption_latencies``.
+
+        Returns:
+            ``True`` if the claim was cancelled.
+        """
+        if claim is None or claim.cancelled_at is None:
+            return False
+        if not claim.observed:
+            claim.observed = True
+            latency = time.monotonic() - claim.cancelled_at
+            self.preemption_latencies.append(latency)
+            if latency > self.MAX_PREEMPTION_LATENCY:
+                self._logger.warning(f"{claim.owner} preemption took {latency:.3f} s")
+        return True
+
+    async def _write_motion(self, command: bytearray, claim: Optional[MotionClaim]):
+        if claim is None or claim.cancelled:
+            # refused or superseded source, another owner is driving the desk
+            return
+        request = self._client.write_gatt_char(_UUID_COMMAND, command, response=False)
+        if PROFILER.active:
+            with PROFILER.phase("ble"):
+                await request
+        else:
+            await request
+
+    async def move_up(self, claim: Optional[MotionClaim] = UNARBITRATED):
+        """
+        Move the desk upwards.
+
+        This command moves the desk upwards for a fixed duration
+        (approximately one second) as set by your desk controller.
+
+        Args:
+            claim: Motion claim of the caller, the command is dropped if it was
+                refused (``None``) or preempted. Callers outside arbitration
+                keep the default.
+
+        >>> async def example():
+        ...     async with IdasenDesk(mac="AA:AA:AA:AA:AA:AA") as desk:
+        ...         await desk.move_up()
+        >>> asyncio.run(example())
+        """
+        await self._write_motion(_COMMAND_UP, claim)
+
+    async def move_down(self, claim: Optional[MotionClaim] = UNARBITRATED):
+        """
+        Move the desk downwards.
+
+        This command moves the desk downwards for a fixed duration
+        (approximately one second) as set by your desk controller.
+
+        Args:
+            claim: Motion claim of the caller, the command is dropped if it was
+                refused (``None``) or preempted. Callers outside arbitration
+                keep the default.
+
+        >>> async def example():
+        ...     async with IdasenDesk(mac="AA:AA:AA:AA:AA:AA") as desk:
+        ...         await desk.move_down()
+        >>> asyncio.run(example())
+        """
+        await self._write_motion(_COMMAND_DOWN, claim)
+
+    def move_to_target(
+        self,
+        target: float,
+        priority: int = PRIORITY_PRESET,
+        timeout: Optional[float] = None,
+        claim: Optional[MotionClaim] = None,
+    ) -> "MoveTask":
+        """
+        Move the desk to the target position.
+
+        The move runs in the background as soon as this method returns, it must
+        be called from a running event loop. Awaiting the returned task gives a
+        :class:`MoveResult`, iterating over it with ``async for`` gives
+        :class:`MoveProgress` events until the move ends. What the desk did is
+        fed to ``calibration`` once the target is reached.
+
+        Args:
+            target: Target position in meters.
+            priority: Motion priority of the move.
+            timeout: Seconds after which the move is stopped, ``None`` for no limit.
+            claim: Claim already acquired for the move, for callers arbitrating
+                when the move is requested rather than when it starts. It stays
+                owned by the caller, who releases it.
+
+        Returns:
+            Handle of the move.
+
+        Raises:
+            ValueError: Target is not a number or exceeds maximum or minimum limits.
+
+        >>> async def example():
+        ...     async with IdasenDesk(mac="AA:AA:AA:AA:AA:AA") as desk:
+        ...         result = await desk.move_to_target(1.1)
+        ...         return result.reason
+        >>> asyncio.run(example())
+        'reached'
+        """
+        if not math.isfinite(target):
+            raise ValueError(f"target position of {target} meters is not a number")
+        elif target > self.MAX_HEIGHT:
+            raise ValueError(
+                f"target position of {target:.3f} meters exceeds maximum of "
+                f"{self.MAX_HEIGHT:.3f}"
+            )
+        elif target < self.MIN_HEIGHT:
+            raise ValueError(
+                f"target position of {target:.3f} meters exceeds minimum of "
+                f"{self.MIN_HEIGHT:.3f}"
+            )
+        return MoveTask(self, target, priority, timeout, claim)
+
+    async def _write_stop(self, claim: Optional[MotionClaim]):
+        # stop a move on behalf of its owner, which keeps the desk
+        if claim is None or claim.cancelled:
+            return
+        request = asyncio.gather(
+            self._client.write_gatt_char(_UUID_COMMAND, _COMMAND_STOP, response=False),
+            self._client.write_gatt_char(
+                _UUID_REFERENCE_INPUT, _COMMAND_REFERENCE_INPUT_STOP, response=False
+            ),
+        )
+        if PROFILER.active:
+            with PROFILER.phase("ble"):
+                await request
+        else:
+            await request
+
+    async def stop(self):
+        """ Stop desk movement, cancelling whichever source owns the desk. """
+        claim = self.acquire_motion("stop", self.PRIORITY_STOP)
+        try:
+            await self._write_stop(claim)
+        finally:
+            self.release_motion(claim)
+
+    async def get_height(self) -> float:
+        """
+        Get the desk height in meters.
+
+        Returns:
+            Desk height in meters.
+
+        >>> async def example() -> float:
+        ...     async with IdasenDesk(mac="AA:AA:AA:AA:AA:AA") as desk:
+        ...         await desk.move_to_target(1.0)
+        ...         return await desk.get_height()
+        >>> asyncio.run(example())
+        1.0
+        """
+        if PROFILER.active:
+            with PROFILER.phase("ble"):
+                raw = await self._client.read_gatt_char(_UUID_HEIGHT)
+        else:
+            raw = await self._client.read_gatt_char(_UUID_HEIGHT)
+        return _bytes_to_meters(raw)
+
+    async def get_filtered_height(self) -> float:
+        """
+        Read the desk height and feed it through ``height_filter``.
+
+        Returns:
+            Filtered desk height in meters, the filtered velocity is available
+            from ``height_filter.velocity``.
+        """
+        height = await self.get_height()
+        return self.height_filter.update(height, self.monotonic())
+
+    @classmethod
+    async def discover(cls) -> Optional[str]:
+        """
+        Try to find the desk's MAC address by discovering currently connected devices.
+
+        Returns:
+            MAC address if found, ``None`` if not found.
+        """
+        try:
+            from bleak import discover
+            devices = await discover()
+        except Exception:
+            return None
+        return next(
+            (device.address for device in devices if device.name.startswith("Desk")),
+            None,
+        )
+#==========================================================================
+# HeightFilter class, smooths height samples before control decisions
+#==========================================================================
+class HeightFilter:
+    """
+    Streaming median-of-3 and EMA filter for desk height samples.
+
+    The filtered height is the median of the last three samples, which rejects
+    a single noisy reading without lagging a moving desk. The velocity is an
+    exponential moving average of the filtered height derivative. Samples
+    out of the desk range or not newer than the previous one are dropped, and
+    a sample arriving after ``max_age`` seconds restarts the filter since the
+    history no longer describes the desk. Updates allocate no containers.
+
+    Args:
+        alpha: EMA weight of the newest velocity sample.
+        max_age: Seconds after which the filtered state is considered stale.
+    """
+
+    __slots__ = ("alpha", "max_age", "height", "velocity", "timestamp", "_s0", "_s1", "_s2", "_count")
+
+    def __init__(self, alpha: float = 0.5, max_age: float = 1.5):
+        self.alpha = alpha
+        self.max_age = max_age
+        self.reset()
+
+    def reset(self):
+        """ Forget every sample. """
+        self.height = 0.0
+        self.velocity = 0.0
+        self.timestamp = 0.0
+        self._s0 = self._s1 = self._s2 = 0.0
+        self._count = 0
+
+    def is_stale(self, now: float) -> bool:
+        """ Check whether the last accepted sample is older than ``max_age``. """
+        return self._count == 0 or now - self.timestamp > self.max_age
+
+    def forget_if_resting(self, now: float):
+        """
+        Forget the history of a filter at rest or stale.
+
+        The median of a desk at rest only remembers earlier polls, possibly
+        long ago while the desk was moved with its switch, so the next sample
+        is taken as is. A moving desk keeps its history and velocity.
+        """
+        if self.velocity == 0.0 or self.is_stale(now):
+            self.reset()
+
+    def update(self, raw: float, timestamp: float) -> float:
+        """
+        Feed a raw height sample.
+
+        Args:
+            raw: Height read from the desk in meters.
+            timestamp: Monotonic time of the reading in seconds.
+
+        Returns:
+            Filtered height in meters.
+        """
+        if not IdasenDesk.MIN_HEIGHT <= raw <= IdasenDesk.MAX_HEIGHT:
+            return self.height
+        if self._count:
+            if timestamp <= self.timestamp:
+                return self.height
+            if self.is_stale(timestamp):
+                self.reset()
+        if self._count == 0:
+            self._s0 = self._s1 = self._s2 = raw
+            self.height = raw
+            self.velocity = 0.0
+            self.timestamp = timestamp
+            self._count = 1
+            return raw
+
+        self._s0 = self._s1
+        self._s1 = self._s2
+        self._s2 = raw
+        s0 = self._s0
+        s1 = self._s1
+        median = s0 + s1 + raw - max(s0, s1, raw) - min(s0, s1, raw)
+        instant_velocity = (median - self.height) / (timestamp - self.timestamp)
+        self.velocity += self.alpha * (instant_velocity - self.velocity)
+        if abs(self.velocity) < 1e-4:
+            self.velocity = 0.0
+        self.height = median
+        self.timestamp = timestamp
+        self._count += 1
+        return median
+
+#==========================================================================
+# DeskCalibration class, motion characteristics learned from observed moves
+#==========================================================================
+class DeskCalibration:
+    """
+    Learned travel speed, startup latency and coast distance of one desk.
+
+    Every preset move reports what the desk actually did through
+    :meth:`observe`, the values are running averages so a new load on the desk
+    is picked up after a few moves. Defaults match the constants the move
+    loop used before calibration, with no coast compensation.
+    """
+
+    #: Weight of a new observation once a direction has been observed.
+    LEARNING_RATE: float = 0.3
+
+    #: Observations beyond these bounds are considered glitches and ignored.
+    MAX_SPEED: float = 0.1
+    MAX_LATENCY: float = 2.0
+    MAX_COAST: float = 0.05
+
+    __slots__ = (
+        "up_speed", "down_speed",
+        "up_latency", "down_latency",
+        "up_coast", "down_coast",
+        "up_samples", "down_samples",
+    )
+
+    def __init__(
+        self,
+        up_speed: float = 0.035,
+        down_speed: float = 0.035,
+        up_latency: float = 0.5,
+        down_latency: float = 0.75,
+        up_coast: float = 0.0,
+        down_coast: float = 0.0,
+        up_samples: int = 0,
+        down_samples: int = 0,
+    ):
+        self.up_speed = up_speed
+        self.down_speed = down_speed
+        self.up_latency = up_latency
+        self.down_latency = down_latency
+        self.up_coast = up_coast
+        self.down_coast = down_coast
+        self.up_samples = up_samples
+        self.down_samples = down_samples
+
+    @classmethod
+    def from_config(cls, values: dict) -> "DeskCalibration":
+        """ Build a calibration from its config entry, unknown keys are ignored. """
+        return cls(**{name: values[name] for name in cls.__slots__ if name in values})
+
+    def to_config(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def _prefix(self, direction: int) -> str:
+        return "up_" if direction == DeskState.UP else "down_"
+
+    def speed(self, direction: int) -> float:
+        """ Travel speed in meters per second. """
+        return getattr(self, self._prefix(direction) + "speed")
+
+    def latency(self, direction: int) -> float:
+        """ Seconds between the first move command and the desk moving. """
+        return getattr(self, self._prefix(direction) + "latency")
+
+    def coast(self, direction: int) -> float:
+        """ Meters travelled after the stop command. """
+        return getattr(self, self._prefix(direction) + "coast")
+
+    def eta(self, distance: float, direction: int, moving: bool = True) -> float:
+        """ Estimated seconds to travel ``distance`` meters. """
+        seconds = abs(distance) / self.speed(direction)
+        return seconds if moving else seconds + self.latency(direction)
+
+    def observe(self, direction: int, latency: float, speed: float, coast: float) -> bool:
+        """
+        Learn from one completed move.
+
+        Returns:
+            ``True`` if the observation was plausible and has been applied.
+        """
+        if not (0 < speed <= self.MAX_SPEED and 0 <= latency <= self.MAX_LATENCY
+                and 0 <= coast <= self.MAX_COAST):
+            return False
+        prefix = self._prefix(direction)
+        samples = getattr(self, prefix + "samples")
+        rate = 1.0 if samples == 0 else self.LEARNING_RATE
+        for name, value in (("speed", speed), ("latency", latency), ("coast", coast)):
+            current = getattr(self, prefix + name)
+            setattr(self, prefix + name, current + rate * (value - current))
+        setattr(self, prefix + "samples", samples + 1)
+        return True
+
+#==========================================================================
+# DeskState class, immutable snapshot of the desk shared between threads
+#==========================================================================
+class DeskState:
+    """
+    Immutable snapshot of the desk state.
+
+    Snapshots are never modified once published: the worker builds a new one
+    with :meth:`replace` and swaps the reference, so any thread reading
+    ``worker.state`` gets a consistent view without locking.
+    """
+
+    #: Moving directions.
+    IDLE: int = 0
+    UP: int = 1
+    DOWN: int = -1
+
+    __slots__ = ("height", "velocity", "direction", "target", "connected", "timestamp", "version")
+
+    def __init__(
+        self,
+        height: float = 0.0,
+        velocity: float = 0.0,
+        direction: int = 0,
+        target: Optional[float] = None,
+        connected: bool = False,
+        timestamp: float = 0.0,
+        version: int = 0,
+    ):
+        set_slot = object.__setattr__
+        set_slot(self, "height", height)
+        set_slot(self, "velocity", velocity)
+        set_slot(self, "direction", direction)
+        set_slot(self, "target", target)
+        set_slot(self, "connected", connected)
+        set_slot(self, "timestamp", timestamp)
+        set_slot(self, "version", version)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("DeskState is immutable, use replace()")
+
+    def replace(self, **changes) -> "DeskState":
+        """ Return a copy of the snapshot with the given fields changed. """
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return DeskState(**fields)
+
+    def __repr__(self) -> str:
+        return (
+            f"DeskState(version={self.version}, height={self.height:.3f}, "
+            f"velocity={self.velocity:.3f}, direction={self.direction}, "
+            f"target={self.target}, connected={self.connected})"
+        )
+
+#==========================================================================
+# MoveTask class, handle of a move started by IdasenDesk.move_to_target
+#==========================================================================
+class MoveProgress:
+    """ Progress event of a move. """
+
+    __slots__ = ("height", "velocity", "eta", "timestamp")
+
+    def __init__(self, height: float, velocity: float, eta: float, timestamp: float):
+        self.height = height
+        self.velocity = velocity
+        #: Estimated seconds left before reaching the target.
+        self.eta = eta
+        self.timestamp = timestamp
+
+    def __repr__(self) -> str:
+        return f"MoveProgress(height={self.height:.3f}, velocity={self.velocity:.3f}, eta={self.eta:.1f})"
+
+
+class MoveResult:
+    """
+    Outcome of a move, truthy when the target was reached.
+
+    ``reason`` is one of ``"reached"``, ``"refused"``, ``"preempted"``,
+    ``"cancelled"``, ``"timeout"`` or ``"stalled"``. ``calibrated`` tells
+    whether the move improved the desk calibration.
+    """
+
+    __slots__ = ("reason", "target", "height", "duration", "commands", "samples", "calibrated")
+
+    def __init__(
+        self,
+        reason: str,
+        target: float,
+        height: float,
+        duration: float,
+        commands: int,
+        samples: int,
+        calibrated: bool = False,
+    ):
+        self.reason = reason
+        self.target = target
+        self.height = height
+        self.duration = duration
+        self.commands = commands
+        self.samples = samples
+        self.calibrated = calibrated
+
+    @property
+    def reached(self) -> bool:
+        return self.reason == "reached"
+
+    @property
+    def error(self) -> float:
+        """ Final height minus target, in meters. """
+        return self.height - self.target
+
+    def __bool__(self) -> bool:
+        return self.reached
+
+    def __repr__(self) -> str:
+        return (
+            f"MoveResult(reason={self.reason!r}, target={self.target:.3f}, "
+            f"height={self.height:.3f}, duration={self.duration:.2f}, "
+            f"commands={self.commands}, samples={self.samples})"
+        )
+
+
+class MoveTask:
+    """
+    Handle of a move running in the background.
+
+    Await the task for its :class:`MoveResult`, or iterate over it with
+    ``async for`` to receive :class:`MoveProgress` events. Progress is kept in
+    a small queue dropping the oldest events, a slow consumer only loses
+    intermediate heights. The task is meant to be iterated by one consumer.
+    """
+
+    #: Progress events kept for a slow consumer.
+    PROGRESS_QUEUE_SIZE: int = 16
+
+    #: Seconds the desk is sampled after the stop command while it coasts.
+    SETTLE_TIMEOUT: float = 2.0
+
+    def __init__(
+        self,
+        desk: IdasenDesk,
+        target: float,
+        priority: int,
+        timeout: Optional[float],
+        claim: Optional[MotionClaim] = None,
+    ):
+        self.target = target
+        self._desk = desk
+        self._priority = priority
+        self._timeout = timeout
+        self._claim = claim
+        self._progress: asyncio.Queue = asyncio.Queue(maxsize=self.PROGRESS_QUEUE_SIZE)
+        self._cancelled = False
+        self._task = asyncio.ensure_future(self._run())
+
+    def __await__(self):
+        return self._task.__await__()
+
+    def cancel(self):
+        """
+        Stop the move, the task then completes with a ``"cancelled"`` result.
+
+        The request is honoured before the next command is sent, so the delay
+        is bounded by one BLE round trip.
+        """
+        self._cancelled = True
+
+    def done(self) -> bool:
+        return self._task.done()
+
+    async def __aiter__(self):
+        while True:
+            progress = await self._progress.get()
+            if progress is None:
+                return
+            yield progress
+
+    def _publish(self, progress: Optional[MoveProgress]):
+        if self._progress.full():
+            self._progress.get_nowait()
+        self._progress.put_nowait(progress)
+
+    async def _settle(self) -> Tuple[float, int]:
+        # sample until the desk stopped coasting, returns its height and the samples taken
+        desk = self._desk
+        deadline = desk.monotonic() + self.SETTLE_TIMEOUT
+        samples = 0
+        while True:
+            height = await desk.get_filtered_height()
+            samples += 1
+            if abs(desk.height_filter.velocity) < desk.STALL_VELOCITY or desk.monotonic() > deadline:
+                return height, samples
+
+    async def _run(self) -> MoveResult:
+        desk = self._desk
+        calibration = desk.calibration
+        target = self.target
+        start = desk.monotonic()
+        deadline = start + self._timeout if self._timeout is not None else None
+        commands = 0
+        samples = 0
+        calibrated = False
+        height = desk.height_filter.height
+        reason = "refused"
+        claim = self._claim
+        if claim is None:
+            claim = desk.acquire_motion("move_to_target", self._priority)
+        try:
+            if claim is None:
+                return MoveResult(reason, target, height, 0.0, commands, samples)
+            # the first command has to go the way the desk is now
+            desk.height_filter.forget_if_resting(start)
+            moving_since = start
+            last_command_time = 0.0
+            # first command, and first sample moving its way, observed for calibration
+            first_command_time = 0.0
+            first_direction = DeskState.IDLE
+            motion_time: Optional[float] = None
+            motion_height = 0.0
+            while True:
+                if desk.check_preempted(claim):
+                    reason = "preempted"
+                    break
+                if self._cancelled:
+                    desk._logger.info(f"move to {target:.3f} cancelled")
+                    reason = "cancelled"
+                    await desk._write_stop(claim)
+                    break
+                height = await desk.get_filtered_height()
+                samples += 1
+                now = desk.monotonic()
+                velocity = desk.height_filter.velocity
+                difference = target - height
+                direction = DeskState.UP if difference > 0 else DeskState.DOWN
+                moving = velocity * direction >= desk.STALL_VELOCITY
+                if moving and motion_time is None and direction == first_direction:
+                    motion_time = now
+                    motion_height = height
+                desk._logger.debug(f"{target=} {height=} {difference=}")
+                self._publish(MoveProgress(height, velocity, calibration.eta(difference, direction, moving), now))
+                # stop early by the distance the desk coasts once moving
+                if moving:
+                    difference -= direction * calibration.coast(direction)
+                if abs(difference) < 0.005 or difference * direction < 0:  # tolerance of 0.005 meters
+                    desk._logger.info(f"reached target of {target:.3f}")
+                    reason = "reached"
+                    await desk._write_stop(claim)
+                    stop_height = height
+                    height, settle_samples = await self._settle()
+                    samples += settle_samples
+                    if motion_time is not None and now > motion_time and direction == first_direction:
+                        calibrated = calibration.observe(
+                            direction,
+                            latency=motion_time - first_command_time,
+                            speed=abs(stop_height - motion_height) / (now - motion_time),
+                            coast=abs(height - stop_height),
+                        )
+                    break
+                if deadline is not None and now > deadline:
+                    desk._logger.warning(f"move to {target:.3f} timed out at {height:.3f}")
+                    reason = "timeout"
+                    await desk._write_stop(claim)
+                    break
+                if abs(velocity) >= desk.STALL_VELOCITY:
+                    moving_since = now
+                elif now - moving_since > desk.STALL_TIMEOUT:
+                    desk._logger.warning(f"desk stalled at {height:.3f}, cancelling move")
+                    reason = "stalled"
+                    await desk._write_stop(claim)
+                    break
+                # each command keeps the desk moving for about a second, repeating it
+                # sooner only floods the radio, and no command is repeated until the
+                # desk starts moving, to workaround issue
+                started = (
+                    commands == 0
+                    or motion_time is not None
+                    or now - first_command_time >= 2 * calibration.latency(direction)
+                )
+                if started and (commands == 0 or now - last_command_time >= _MOVE_COMMAND_INTERVAL):
+                    if direction == DeskState.UP:
+                        await desk.move_up(claim)
+                    else:
+                        await desk.move_down(claim)
+                    if commands == 0:
+                        first_command_time = now
+                        first_direction = direction
+                    last_command_time = now
+                    commands += 1
+        except asyncio.CancelledError:
+            # the event loop is going away, never leave the desk moving
+            await desk.stop()
+            raise
+        finally:
+            if self._claim is None:
+                desk.release_motion(claim)
+            self._publish(None)
+        return MoveResult(reason, target, height, desk.monotonic() - start, commands, samples, calibrated)
+
+#==========================================================================
+# _DeskLoggingAdapter private class 
+#==========================================================================
+class _DeskLoggingAdapter(logging.LoggerAdapter):
+    """ Prepends logging messages with the desk MAC address. """
+
+    def process(self, msg: str, kwargs: Dict[str, str]) -> Tuple[str, Dict[str, str]]:
+        return f"[{self.extra['mac']}] {msg}", kwargs
+
+        
+#==========================================================================
+# BLE trace capture and replay
+# Trace format: header b"IDTR" + version byte, then one record per event:
+#   <d  seconds since the start of the capture (monotonic)
+#   B   event kind, see _TRACE_WRITE, _TRACE_READ and _TRACE_NOTIFY
+#   B   index of the characteristic in _TRACE_UUIDS, 255 if unknown
+#   H   payload length, followed by the payload bytes
+#==========================================================================
+_TRACE_MAGIC: bytes = b"IDTR"
+_TRACE_VERSION: int = 1
+_TRACE_RECORD = struct.Struct("<dBBH")
+_TRACE_WRITE: int = 0
+_TRACE_READ: int = 1
+_TRACE_NOTIFY: int = 2
+_TRACE_UUIDS: Tuple[str, ...] = (_UUID_HEIGHT, _UUID_COMMAND, _UUID_REFERENCE_INPUT)
+_TRACE_UNKNOWN_UUID: int = 255
+
+
+def _trace_uuid_index(uuid) -> int:
+    try:
+        return _TRACE_UUIDS.index(str(uuid).lower())
+    except ValueError:
+        return _TRACE_UNKNOWN_UUID
+
+
+def read_trace(path: str) -> List[Tuple[float, int, int, bytes]]:
+    """
+    Load a BLE trace written by :class:`TraceRecorder`.
+
+    Returns:
+        List of ``(seconds, kind, uuid_index, payload)`` records.
+
+    Raises:
+        ValueError: The file is not a supported trace.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != _TRACE_MAGIC or len(data) < 5 or data[4] != _TRACE_VERSION:
+        raise ValueError(f"{path} is not a version {_TRACE_VERSION} BLE trace")
+    records = []
+    offset = 5
+    while offset + _TRACE_RECORD.size <= len(data):
+        seconds, kind, uuid_index, length = _TRACE_RECORD.unpack_from(data, offset)
+        offset += _TRACE_RECORD.size
+        records.append((seconds, kind, uuid_index, bytes(data[offset:offset + length])))
+        offset += length
+    return records
+
+
+class TraceRecorder:
+    """
+    BLE client wrapper recording every write, read and notification.
+
+    Calls are forwarded to the wrapped client, anything not related to GATT
+    traffic is delegated untouched.
+
+    Args:
+        client: Client to wrap, usually a ``BleakClient``.
+        path: Trace file, overwritten when the recorder is created.
+    """
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self._start = time.monotonic()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # unbuffered so the trace survives a crash, which is when it matters
+        self._file = open(path, "wb", buffering=0)
+        self._file.write(_TRACE_MAGIC + bytes([_TRACE_VERSION]))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _record(self, kind: int, uuid, payload):
+        payload = bytes(payload)
+        header = _TRACE_RECORD.pack(
+            time.monotonic() - self._start, kind, _trace_uuid_index(uuid), len(payload)
+        )
+        self._file.write(header + payload)
+
+    async def __aenter__(self):
+        await self._client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args, **kwargs) -> Optional[bool]:
+        try:
+            return await self._client.__aexit__(*args, **kwargs)
+        finally:
+            self.close()
+
+    def close(self):
+        """ Close the trace file. """
+        if not self._file.closed:
+            self._file.close()
+
+    async def write_gatt_char(self, uuid, data, response: bool = False):
+        self._record(_TRACE_WRITE, uuid, data)
+        return await self._client.write_gatt_char(uuid, data, response=response)
+
+    async def read_gatt_char(self, uuid, **kwargs) -> bytearray:
+        data = await self._client.read_gatt_char(uuid, **kwargs)
+        self._record(_TRACE_READ, uuid, data)
+        return data
+
+    async def start_notify(self, uuid, callback, **kwargs):
+        def recording_callback(sender, data):
+            self._record(_TRACE_NOTIFY, uuid, data)
+            return callback(sender, data)
+
+        return await self._client.start_notify(uuid, recording_callback, **kwargs)
+
+
+class ReplayClient:
+    """
+    BLE client feeding a recorded trace back to :class:`IdasenDesk`.
+
+    Reads return the recorded values in order, no earlier than their recorded
+    time divided by ``speed``. :meth:`monotonic` runs in trace time, the time
+    of the last replayed read, and :class:`IdasenDesk` times its motion
+    control with it, so a replay takes the recorded decisions at any speed.
+    Notifications are delivered once the trace time passed theirs. Writes
+    are not checked against the trace, they are collected in ``writes`` so a
+    replayed run can be compared or benchmarked.
+
+    Args:
+        path: Trace file written by :class:`TraceRecorder`.
+        speed: Replay speed factor, ``0`` replays as fast as possible.
+    """
+
+    def __init__(self, path: str, speed: float = 1.0):
+        records = read_trace(path)
+        self._reads: Dict[int, deque] = {}
+        for seconds, kind, uuid_index, payload in records:
+            if kind == _TRACE_READ:
+                self._reads.setdefault(uuid_index, deque()).append((seconds, payload))
+        self._notifications = deque(
+            (seconds, uuid_index, payload)
+            for seconds, kind, uuid_index, payload in records
+            if kind == _TRACE_NOTIFY
+        )
+        self._callbacks: Dict[int, Callable] = {}
+        self._speed = speed
+        self._start = time.monotonic()
+        self._now = 0.0
+        self._connected = False
+        #: ``(trace seconds, uuid, payload)`` of every write received during the replay.
+        self.writes: List[Tuple[float, str, bytes]] = []
+
+    async def __aenter__(self):
+        self._start = time.monotonic()
+        self._connected = True
+        return self
+
+    async def __aexit__(self, *args, **kwargs) -> Optional[bool]:
+        self._connected = False
+        return None
+
+    async def is_connected(self) -> bool:
+        return self._connected
+
+    def monotonic(self) -> float:
+        """ Trace time in seconds of the last replayed read. """
+        return self._now
+
+    async def _wait_until(self, seconds: float):
+        if self._speed > 0:
+            delay = seconds / self._speed - (time.monotonic() - self._start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def _deliver_notifications(self):
+        while self._notifications and self._notifications[0][0] <= self._now:
+            seconds, uuid_index, payload = self._notifications.popleft()
+            callback = self._callbacks.get(uuid_index)
+            if callback is not None:
+                callback(uuid_index, bytearray(payload))
+
+    async def write_gatt_char(self, uuid, data, response: bool = False):
+        self.writes.append((self._now, str(uuid), bytes(data)))
+        self._deliver_notifications()
+
+    async def read_gatt_char(self, uuid, **kwargs) -> bytearray:
+        pending = self._reads.get(_trace_uuid_index(uuid))
+        if not pending:
+            raise EOFError(f"no more recorded reads for {uuid}")
+        seconds, payload = pending.popleft()
+        await self._wait_until(seconds)
+        self._now = seconds
+        self._deliver_notifications()
+        return bytearray(payload)
+
+    async def start_notify(self, uuid, callback, **kwargs):
+        self._callbacks[_trace_uuid_index(uuid)] = callback
+
+
+class SimulatedClient:
+    """
+    BLE client simulating a desk, to exercise :class:`IdasenDesk` without hardware.
+
+    Like the real controller, a move command keeps the desk moving for
+    ``command_duration`` seconds, starting ``latency`` seconds after a move from
+    rest, and the desk coasts ``coast`` meters once stopped.
+
+    Args:
+        height: Initial desk height in meters.
+        speed: Travel speed in meters per second.
+        latency: Seconds between the first move command and the desk moving.
+        coast: Meters travelled after a stop command.
+        command_duration: Seconds of motion granted by one move command.
+        round_trip: Seconds each read or write takes.
+    """
+
+    def __init__(
+        self,
+        height: float = 0.8,
+        speed: float = 0.038,
+        latency: float = 0.3,
+        coast: float = 0.005,
+        command_duration: float = 1.0,
+        round_trip: float = 0.02,
+    ):
+        self.height = height
+        self.speed = speed
+        self.latency = latency
+        self.coast = coast
+        self.command_duration = command_duration
+        self.round_trip = round_trip
+        #: Number of move and stop commands received.
+        self.commands = 0
+        self._direction = 0
+        self._motion_start = 0.0
+        self._motion_until = 0.0
+        self._updated = time.monotonic()
+        self._connected = False
+
+    async def __aenter__(self):
+        self._connected = True
+        return self
+
+    async def __aexit__(self, *args, **kwargs) -> Optional[bool]:
+        self._connected = False
+        return None
+
+    async def is_connected(self) -> bool:
+        return self._connected
+
+    def _advance(self, now: float):
+        if self._direction:
+            begin = max(self._updated, self._motion_start)
+            end = min(now, self._motion_until)
+            if end > begin:
+                self.height += self._direction * self.speed * (end - begin)
+                self.height = min(max(self.height, IdasenDesk.MIN_HEIGHT), IdasenDesk.MAX_HEIGHT)
+            if now >= self._motion_until:
+                self._direction = 0
+        self._updated = now
+
+    async def write_gatt_char(self, uuid, data, response: bool = False):
+        await asyncio.sleep(self.round_trip)
+        if str(uuid).lower() != _UUID_COMMAND:
+            return
+        now = time.monotonic()
+        self._advance(now)
+        self.commands += 1
+        data = bytes(data)
+        if data == bytes(_COMMAND_STOP):
+            if self._direction and now >= self._motion_start:
+                self.height += self._direction * self.coast
+            self._direction = 0
+            return
+        direction = DeskState.UP if data == bytes(_COMMAND_UP) else DeskState.DOWN
+        if direction != self._direction:
+            self._direction = direction
+            self._motion_start = now + self.latency
+        self._motion_until = max(now, self._motion_start) + self.command_duration
+
+    async def read_gatt_char(self, uuid, **kwargs) -> bytearray:
+        await asyncio.sleep(self.round_trip)
+        self._advance(time.monotonic())
+        return _meters_to_bytes(self.height)
+
+    async def start_notify(self, uuid, callback, **kwargs):
+        pass
+
+#===============================================================
+# PollingPolicy class, idle height polling backing off while stationary
+#===============================================================
+class PollingPolicy:
+    """
+    Interval between idle height reads.
+
+    Polling starts at ``min_interval`` and is multiplied by ``factor`` after
+    every read that finds the desk where it was, up to ``max_interval``. Any
+    change of height brings it back to ``min_interval``.
+    """
+
+    __slots__ = ("min_interval", "max_interval", "factor", "interval")
+
+    def __init__(self, min_interval: float = 0.5, max_interval: float = 30.0, factor: float = 2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.interval = min_interval
+
+    def reset(self):
+        self.interval = self.min_interval
+
+    def backoff(self):
+        self.interval = min(self.interval * self.factor, self.max_interval)
+
+#===============================================================
+# Profiler class, opt-in capture of where the worker and GUI spend time
+#===============================================================
+class Profiler:
+    """
+    Time-boxed profile of the worker and GUI threads.
+
+    While ``active``, every thread calling :meth:`attach` is profiled with its
+    own ``cProfile`` profile, written in pstats format when it detaches, and
+    :meth:`phase` records BLE, sleep and UI timings, written by :meth:`stop`
+    as a Chrome trace event file (chrome://tracing, Perfetto, speedscope).
+    Call sites test ``active`` first, so a disabled profiler costs one branch.
+
+    From Python 3.12 a ``cProfile`` profile records every thread and only one
+    can be enabled at a time, so :meth:`start` enables a single profile of
+    all threads, written by :meth:`stop`, and :meth:`attach` does nothing.
+    """
+
+    #: Phase timings kept per capture.
+    MAX_EVENTS: int = 100000
+
+    def __init__(self):
+        #: One profile per attached thread, otherwise one profile of all threads.
+        self.per_thread = sys.version_info < (3, 12)
+        self.active = False
+        self._directory = "."
+        self._stamp = ""
+        self._started = 0.0
+        self._profiles: Dict[int, Tuple[str, cProfile.Profile]] = {}
+        self._events: deque = deque(maxlen=self.MAX_EVENTS)
+
+    def start(self, directory: str):
+        """
+        Start a capture, threads join it by calling :meth:`attach`.
+
+        Args:
+            directory: Folder receiving the profile files.
+        """
+        if self.active:
+            return
+        self._directory = directory
+        self._stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._events.clear()
+        self._started = time.perf_counter()
+        self.active = True
+        log("profiling started")
+        if not self.per_thread:
+            self._enable("all-threads")
+
+    def _enable(self, name: str):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # another profiler, such as a debugger, is already enabled
+            log(f"not profiling {name}: {e}")
+            return
+        self._profiles[get_ident()] = (name, profile)
+
+    def attach(self, name: str):
+        """ Profile the calling thread until it calls :meth:`detach`, if a capture is active. """
+        if self.active and self.per_thread and get_ident() not in self._profiles:
+            self._enable(name)
+
+    def detach(self):
+        """ Stop profiling the calling thread and write its pstats file. """
+        if self.per_thread:
+            self._write_profile(get_ident())
+
+    def _write_profile(self, ident: int):
+        entry = self._profiles.pop(ident, None)
+        if entry is None:
+            return
+        name, profile = entry
+        profile.disable()
+        path = os.path.join(self._directory, f"profile-{self._stamp}-{name}.prof")
+        os.makedirs(self._directory, exist_ok=True)
+        profile.dump_stats(path)
+        log(f"{name} profile written to {path}")
+
+    @contextmanager
+    def phase(self, name: str):
+        """ Time the enclosed block as phase ``name`` of the calling thread. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._events.append((name, current_thread().name, start, time.perf_counter() - start))
+
+    def stop(self):
+        """ End the capture and write the phase timings, threads still detach themselves. """
+        if not self.active:
+            return
+        self.active = False
+        if self.per_thread:
+            self.detach()
+        else:
+            # enabled by the thread that started the capture, usually this one
+            for ident in list(self._profiles):
+                self._write_profile(ident)
+        threads: Dict[str, int] = {}
+        trace = []
+        for name, thread, start, duration in list(self._events):
+            tid = threads.setdefault(thread, len(threads) + 1)
+            trace.append({
+                "name": name, "cat": "phase", "ph": "X", "pid": 1, "tid": tid,
+                "ts": round((start - self._started) * 1e6), "dur": round(duration * 1e6),
+            })
+        for thread, tid in threads.items():
+            trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": thread}})
+        path = os.path.join(self._directory, f"profile-{self._stamp}-phases.json")
+        os.makedirs(self._directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace}, f)
+        log(f"profiling phases written to {path}")
+
+
+PROFILER = Profiler()
+
+#===============================================================
+# DeskWorkerThread class that executes processing
+# Running in distinct threat with a pseudo-realtime algo
+#===============================================================
+class DeskWorkerThread(Thread):
+    """
+    Worker Thread Class.
+
+    The thread owns one event loop for its whole life. Preset moves run on
+    it as :class:`MoveTask` instances next to the running loop, which keeps
+    handling manual moves, stop requests and idle polling.
+
+    Args:
+        parent_window: Notified from the worker thread through its
+            ``onHeightChanged(height)`` and ``showDisabledButton()`` methods,
+            ``None`` when running headless.
+        save_calibration: Called from the worker thread with the desk MAC
+            address and its calibration config entry whenever it improves.
+    """
+    def __init__(
+        self,
+        parent_window=None,
+        save_calibration: Optional[Callable[[str, dict], None]] = None,
+    ):
+        """Init Worker Thread Class."""                
+        Thread.__init__(self, name="DeskWorker")
+        self._parent_window = parent_window
+        self._save_calibration = save_calibration
+        # (coroutine function, claim, argument) of preset moves and calibrations,
+        # handed over by the GUI and MQTT threads
+        self._move_requests: queue.Queue = queue.Queue()
+        self._manual_direction = DeskState.IDLE
+        self.stop_requested = False
+        self.refresh_requested = False
+        self.polling = PollingPolicy()
+        #: Number of times the running loop woke up while idle.
+        self.wakeups = 0
+        self._started_at = 0.0
+        self._paused = False
+        self._loop = asyncio.new_event_loop()
+        # created by the running loop, on the loop it belongs to
+        self._wake: Optional[asyncio.Event] = None
+        # preset move in progress and the coroutine following it
+        self._move: Optional[MoveTask] = None
+        self._preset: Optional[asyncio.Future] = None
+        self.mqtt_bridge: Optional["MqttBridge"] = None
+        self.workerThread = False
+        #: ``(target, error in meters, move commands sent)`` of the last preset moves.
+        self.move_stats: deque = deque(maxlen=50)
+        self._state = DeskState()
+        self._state_changed = Condition()
+
+    @property
+    def state(self) -> DeskState:
+        """ Latest published desk state snapshot, safe to read from any thread. """
+        return self._state
+
+    @property
+    def manual_direction(self) -> int:
+        """ Direction requested by the up/down buttons, written by the GUI thread. """
+        return self._manual_direction
+
+    @manual_direction.setter
+    def manual_direction(self, direction: int):
+        self._manual_direction = direction
+        self.wake()
+
+    def wake(self):
+        """ Interrupt the idle wait, call after handing a command to the worker. """
+        if self._wake is None:
+            # not running yet, the first pass handles every pending command
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            # the running loop has ended
+            pass
+
+    async def _sleep(self, timeout: Optional[float]) -> bool:
+        # wait for wake() or the timeout, returns True if woken
+        try:
+            if PROFILER.active:
+                with PROFILER.phase("sleep"):
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+            else:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            woken = True
+        except asyncio.TimeoutError:
+            woken = False
+        self._wake.clear()
+        return woken
+
+    def refresh(self) -> int:
+        """
+        Read the desk height on the next loop pass, whatever the polling interval.
+
+        Returns:
+            Version of the current snapshot, :meth:`wait_for_state` with it
+            returns the snapshot holding the fresh height.
+        """
+        version = self._state.version
+        self.polling.reset()
+        self.refresh_requested = True
+        self.wake()
+        return version
+
+    def request_stop(self):
+        """ Stop the desk on the next loop pass, safe to call from any thread. """
+        self.stop_requested = True
+        self.wake()
+
+    def pause(self):
+        """ Stop idle polling, for instance while the system is suspended. """
+        log("pausing idle polling")
+        self._paused = True
+
+    def resume(self):
+        log("resuming idle polling")
+        self._paused = False
+        self.polling.reset()
+        self.wake()
+
+    def wakeups_per_hour(self) -> float:
+        """ Idle wakeups of the running loop per hour since it started. """
+        elapsed = time.monotonic() - self._started_at
+        return self.wakeups * 3600 / elapsed if self._started_at and elapsed > 0 else 0.0
+
+    @property
+    def current_height(self) -> float:
+        return self._state.height
+
+    def wait_for_state(self, version: int, timeout: Optional[float] = None) -> DeskState:
+        """
+        Wait until a snapshot newer than ``version`` is published.
+
+        Returns:
+            The latest snapshot, which is unchanged if the timeout expired.
+        """
+        with self._state_changed:
+            self._state_changed.wait_for(lambda: self._state.version != version, timeout)
+        return self._state
+
+    def _publish_state(self, **changes):
+        # the worker thread publishes, and connect() from the GUI thread before it runs,
+        # the condition lock keeps versions increasing whichever thread it is
+        with self._state_changed:
+            previous = self._state
+            self._state = previous.replace(timestamp=time.monotonic(), version=previous.version + 1, **changes)
+            self._state_changed.notify_all()
+
+    def _publish_height(self, height: float, velocity: float, **changes):
+        changed = self._state.height != height
+        self._publish_state(height=height, velocity=velocity, **changes)
+        if changed and self._parent_window is not None:
+            self._parent_window.onHeightChanged(height)
+
+    def connect(
+        self,
+        mac: str,
+        calibration: Optional[dict] = None,
+        trace_path: Optional[str] = None,
+        client=None,
+    ) -> bool:
+        """
+        Connect to the desk, before starting the running loop.
+
+        Args:
+            mac: Bluetooth MAC address of the desk.
+            calibration: Saved calibration config entry of the desk.
+            trace_path: If set, BLE traffic is recorded to this file.
+            client: Transport to use instead of Bluetooth, such as a
+                :class:`SimulatedClient`.
+        """
+        self.idasen_desk = IdasenDesk(mac, exit_on_fail=False, client=client, trace_path=trace_path)
+        self.idasen_desk.RETRY_COUNT = 0
+        self.idasen_desk.calibration = DeskCalibration.from_config(calibration or {})
+        # the connection lives on the loop the running loop will use
+        self._loop.run_until_complete(self.idasen_desk._connect())
+        connected = self._loop.run_until_complete(self.idasen_desk.is_connected())
+        self._publish_state(connected=connected)
+        return connected
+
+    def start_running_loop(self, mqtt_broker: str = ""):
+        # This starts the thread running loop
+        self.workerThread = True
+        self._started_at = time.monotonic()
+        self.start()
+        if mqtt_broker and self.mqtt_bridge is None:
+            # the bridge imports this module, only load it when configured
+            from mqtt_bridge import MqttBridge
+            from mqtt_bridge import PahoBrokerClient
+            try:
+                self.mqtt_bridge = MqttBridge(self, PahoBrokerClient(mqtt_broker))
+                self.mqtt_bridge.start()
+            except Exception as e:
+                log(f"MQTT bridge disabled: {e}")
+
+    def stop_running_loop(self):
+        self.workerThread = False        
+        self.wake()
+        if self.mqtt_bridge is not None:
+            self.mqtt_bridge.stop()
+
+    def is_connected(self) -> bool:
+        return self._state.connected
+
+    def move_to_height(self, height, priority: int = IdasenDesk.PRIORITY_PRESET):
+        if not math.isfinite(height):
+            log(f"ignoring target height of {height} meters")
+        elif height > self.idasen_desk.MAX_HEIGHT:
+            log(f"target height of {height:.3f} meters exceeds maximum of {self.idasen_desk.MAX_HEIGHT:.3f}")
+        elif height < self.idasen_desk.MIN_HEIGHT:
+            log(f"target height of {height:.3f} meters exceeds minimum of {self.idasen_desk.MIN_HEIGHT:.3f}")
+        else:
+            claim = self.idasen_desk.acquire_motion("preset", priority)
+            if claim is None:
+                log(f"ignoring target height of {height:.3f} meters, desk is owned by {self.idasen_desk.motion_owner}")
+                return
+            log(f"moving to target height of {height:.3f} meters")
+            self._move_requests.put((self._preset_move, claim, height))
+            self.wake()
+
+    def calibrate(self, distance: float = 0.1, priority: int = IdasenDesk.PRIORITY_PRESET):
+        """
+        Learn the desk motion by moving away by ``distance`` meters and back.
+
+        Both legs are regular preset moves run under one claim, starting from
+        the height the worker reads when it takes the request. The calibration
+        is updated and saved as each of them settles.
+        """
+        claim = self.idasen_desk.acquire_motion("calibration", priority)
+        if claim is None:
+            log(f"ignoring calibration, desk is owned by {self.idasen_desk.motion_owner}")
+            return
+        self._move_requests.put((self._calibrate, claim, distance))
+        self.wake()
+
+    def _start_preset(self, preset):
+        # a preset it replaces was preempted by the new claim and ends on its own
+        self._preset = asyncio.ensure_future(preset)
+        self._preset.add_done_callback(lambda preset: self._wake.set())
+
+    async def _preset_move(self, claim: MotionClaim, target: float):
+        try:
+            await self._run_preset(claim, target)
+        finally:
+            self.idasen_desk.release_motion(claim)
+
+    async def _calibrate(self, claim: MotionClaim, distance: float):
+        desk = self.idasen_desk
+        try:
+            start = await desk.get_filtered_height()
+            away = start + distance
+            if away > desk.MAX_HEIGHT:
+                away = start - distance
+            log(f"calibrating desk between {start:.3f} and {away:.3f} meters")
+            result = await self._run_preset(claim, away)
+            # the way back is owed whatever the first leg taught, unless someone took over
+            if result.reason not in ("preempted", "cancelled"):
+                await self._run_preset(claim, start)
+        finally:
+            desk.release_motion(claim)
+
+    async def _run_preset(self, claim: MotionClaim, target: float) -> MoveResult:
+        desk = self.idasen_desk
+        move = desk.move_to_target(target, claim=claim)
+        self._move = move
+        async for progress in move:
+            if self._move is move:
+                direction = DeskState.UP if target > progress.height else DeskState.DOWN
+                self._publish_height(progress.height, progress.velocity, direction=direction, target=target)
+        result = await move
+        current = self._move is move
+        if current:
+            self._move = None
+        if result.reason == "preempted":
+            log("move_to_height superseded by another command")
+            return result
+        self.move_stats.append((target, result.error, result.commands))
+        log(f"move to {target:.3f} {result.reason} at {result.height:.3f} "
+            f"(error {result.error * 1000:+.1f} mm, {result.commands} commands)")
+        if current:
+            self._publish_height(result.height, desk.height_filter.velocity, direction=DeskState.IDLE, target=None)
+        if result.calibrated and self._save_calibration is not None:
+            self._save_calibration(desk.mac, desk.calibration.to_config())
+        return result
+
+    async def _stop_preset(self):
+        # the running loop is ending, never leave the desk moving
+        if self._move is not None:
+            self._move.cancel()
+        if self._preset is not None:
+            await asyncio.gather(self._preset, return_exceptions=True)
+
+    def run(self):
+        """Run Worker Thread."""   
+        log("Starting worker thread...")
+        try:
+            self._loop.run_until_complete(self._run())
+            log(f"Returning from worker thread ({self.wakeups_per_hour():.0f} wakeups per hour).")
+        except Exception as e:
+            log(e)
+            self._publish_state(connected=False, direction=DeskState.IDLE, target=None)
+            self.workerThread = False 
+            if self._parent_window is not None:
+                self._parent_window.showDisabledButton()
+        finally:
+            PROFILER.detach()
+            self._loop.close()
+
+    async def _run(self):
+        self._wake = asyncio.Event()
+        desk = self.idasen_desk
+        manual_claim = None
+        refresh_now = True
+        profiling = False
+
+        try:
+            while self.workerThread:
+                # pseudo-realtime running loop, everything in there should be quick
+                # without per thread profiles, the one started by the GUI covers this thread
+                if PROFILER.per_thread and PROFILER.active != profiling:
+                    profiling = PROFILER.active
+                    if profiling:
+                        PROFILER.attach("worker")
+                    else:
+                        PROFILER.detach()
+                if self.stop_requested:
+                    # the stop claim preempts any preset move, which then ends on its own
+                    self.stop_requested = False
+                    log("stop requested...")
+                    await desk.stop()
+                    self._publish_state(direction=DeskState.IDLE, target=None)
+                    refresh_now = True
+                refresh_requested = self.refresh_requested
+                if refresh_requested:
+                    self.refresh_requested = False
+                    refresh_now = True
+                manual_direction = self.manual_direction
+                if manual_direction != DeskState.IDLE:
+                    # manual moves preempt any preset move in progress
+                    if manual_claim is None or desk.check_preempted(manual_claim):
+                        manual_claim = desk.acquire_motion("manual", desk.PRIORITY_MANUAL)
+                    # a refused claim moves nothing, it is asked again next pass
+                    if manual_claim is not None:
+                        # move up sequence
+                        if manual_direction == DeskState.UP:
+                            log("moving up...")
+                            await desk.move_up(manual_claim)
+                        # move down sequence
+                        else:
+                            log("moving down...")
+                            await desk.move_down(manual_claim)
+                        self._publish_state(direction=manual_direction, target=None)
+                    refresh_now = True
+                # stop moving
+                elif manual_claim is not None:
+                    log("stop moving...")
+                    await desk.stop()
+                    manual_claim = None
+                    self._publish_state(direction=DeskState.IDLE)
+                    refresh_now = True
+
+                # move_to_height button 1 or 2 pressed, let's move to target
+                # the latest request wins, its claim already preempted the others
+                move_request = None
+                while not self._move_requests.empty():
+                    move_request = self._move_requests.get_nowait()
+                if move_request is not None:
+                    preset, claim, argument = move_request
+                    if desk.check_preempted(claim):
+                        log("move_to_height superseded by another command")
+                    else:
+                        self._start_preset(preset(claim, argument))
+                if self._preset is not None and self._preset.done():
+                    preset, self._preset = self._preset, None
+                    # a BLE failure during the move ends the running loop like any other
+                    preset.result()
+                    refresh_now = True
+
+                if self._preset is not None and manual_direction == DeskState.IDLE:
+                    # the move samples the desk itself, wait until it ends or a command arrives
+                    await self._sleep(None)
+                #auto-refresh current height label
+                elif refresh_now:                
+                    if refresh_requested:
+                        # asked for the height as it is now, not as the last polls saw it
+                        desk.height_filter.forget_if_resting(desk.monotonic())
+                    height = await desk.get_filtered_height()
+                    velocity = desk.height_filter.velocity
+                    if self._state.height != height:
+                        # moved, possibly from the desk switch, poll quickly again
+                        self.polling.reset()
+                    else:
+                        self.polling.backoff()
+                    # a requested refresh is published even unchanged, someone waits for it
+                    if refresh_requested or self._state.height != height or self._state.velocity != velocity:
+                        self._publish_height(height, velocity)
+                    refresh_now = False
+                else:
+                    # we are IDLE... sleep until a command arrives or the next poll is due
+                    woken = await self._sleep(None if self._paused else self.polling.interval)
+                    self.wakeups += 1
+                    # a command is handled first, its refresh follows
+                    refresh_now = not woken
+        finally:
+            await self._stop_preset()
+
+
+def _bytes_to_meters(raw: bytearray) -> float:
+    """ Converts a value read from the desk in bytes to meters. """
+    raw_len = len(raw)
+    expected_len = 4
+    assert (
+        raw_len == expected_len
+    ), f"Expected raw value to be {expected_len} bytes long, got {raw_len} bytes"
+
+    high_byte = int(raw[1])
+    low_byte = int(raw[0])
+    raw = (high_byte << 8) + low_byte
+    return float(raw / 10000) + IdasenDesk.MIN_HEIGHT
+
+
+def _meters_to_bytes(height: float) -> bytearray:
+    """ Converts a height in meters to the 4 bytes value reported by the desk. """
+    raw = round((height - IdasenDesk.MIN_HEIGHT) * 10000)
+    return bytearray([raw & 0xFF, (raw >> 8) & 0xFF, 0, 0])
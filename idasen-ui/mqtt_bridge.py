@@ -0,0 +1,232 @@
+# IDASEN UI - MQTT BRIDGE
+# Publishes desk state to a home-automation broker and accepts commands from
+# it. paho-mqtt is optional, the bridge only needs it to reach a real broker.
+import json
+import math
+import time
+
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from threading import Thread
+
+from idasen_desk import DeskState
+from idasen_desk import DeskWorkerThread
+from idasen_desk import log
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    # optional, only needed when mqtt_broker is configured
+    mqtt = None
+
+#===============================================================
+# Broker connections, in-process for tests or paho-mqtt
+#===============================================================
+class LocalBroker:
+    """
+    In-process stand-in for a broker connection, used to test :class:`MqttBridge`.
+
+    Published messages are kept in ``messages`` and retained ones in
+    ``retained``, subscribers of a topic are called synchronously.
+    """
+
+    def __init__(self):
+        self.messages: List[Tuple[str, str, bool]] = []
+        self.retained: Dict[str, str] = {}
+        self.connected = False
+        self._subscriptions: Dict[str, List[Callable]] = {}
+
+    def connect(self):
+        self.connected = True
+
+    def disconnect(self):
+        self.connected = False
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def publish(self, topic: str, payload: str, retain: bool = False) -> bool:
+        if not self.connected:
+            return False
+        self.messages.append((topic, payload, retain))
+        if retain:
+            self.retained[topic] = payload
+        for callback in self._subscriptions.get(topic, []):
+            callback(topic, payload)
+        return True
+
+    def subscribe(self, topic: str, callback: Callable):
+        self._subscriptions.setdefault(topic, []).append(callback)
+
+
+class PahoBrokerClient:
+    """
+    Persistent broker connection based on paho-mqtt.
+
+    The connection is opened once in the background and paho reconnects it
+    on its own, subscriptions are renewed after every reconnection.
+
+    Args:
+        broker: Broker address as ``host`` or ``host:port``.
+    """
+
+    def __init__(self, broker: str):
+        if mqtt is None:
+            raise RuntimeError("paho-mqtt is not installed")
+        host, _, port = broker.partition(":")
+        self._host = host
+        self._port = int(port) if port else 1883
+        try:
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        except AttributeError:
+            # paho-mqtt 1.x
+            self._client = mqtt.Client()
+        self._client.on_connect = self._on_connect
+        self._subscriptions: Dict[str, Callable] = {}
+
+    def _on_connect(self, client, *args):
+        for topic in self._subscriptions:
+            client.subscribe(topic)
+
+    def connect(self):
+        self._client.connect_async(self._host, self._port)
+        self._client.loop_start()
+
+    def disconnect(self):
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def is_connected(self) -> bool:
+        return self._client.is_connected()
+
+    def publish(self, topic: str, payload: str, retain: bool = False) -> bool:
+        if not self._client.is_connected():
+            return False
+        info = self._client.publish(topic, payload, qos=1, retain=retain)
+        return info.rc == mqtt.MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic: str, callback: Callable):
+        self._subscriptions[topic] = callback
+        self._client.message_callback_add(
+            topic, lambda client, userdata, message: callback(message.topic, message.payload.decode())
+        )
+        if self._client.is_connected():
+            self._client.subscribe(topic)
+
+
+class MqttBridge(Thread):
+    """
+    Publishes desk state to an MQTT broker and accepts move and stop commands.
+
+    The bridge runs in its own thread and only reads the worker state
+    snapshots, commands are handed to the worker without waiting, so the BLE
+    command path is never blocked by the broker. State is published when the
+    height moves by more than ``deadband`` or the direction, target or
+    connection changes, and at least every ``heartbeat`` seconds. Messages
+    that cannot be sent are kept, latest per topic, and sent once the
+    connection is back.
+
+    Topics, below ``idasen/<mac>``:
+        ``state``: retained JSON with height, direction, target and connected.
+        ``command``: ``stop``, or a target height in meters.
+
+    Args:
+        worker: Desk worker thread to bridge.
+        client: Broker connection, :class:`PahoBrokerClient` or :class:`LocalBroker`.
+        deadband: Height change in meters that triggers a publish.
+        heartbeat: Maximum seconds between two state publishes.
+    """
+
+    def __init__(self, worker: DeskWorkerThread, client, deadband: float = 0.005, heartbeat: float = 60.0):
+        Thread.__init__(self, daemon=True)
+        self._worker = worker
+        self._client = client
+        self.deadband = deadband
+        self.heartbeat = heartbeat
+        mac = worker.idasen_desk.mac.replace(":", "").lower()
+        self.state_topic = f"idasen/{mac}/state"
+        self.command_topic = f"idasen/{mac}/command"
+        self._discovery_topic = f"homeassistant/sensor/idasen_{mac}/height/config"
+        self._discovery = json.dumps({
+            "name": "Desk height",
+            "unique_id": f"idasen_{mac}_height",
+            "state_topic": self.state_topic,
+            "value_template": "{{ value_json.height }}",
+            "unit_of_measurement": "m",
+        })
+        self._outbox: Dict[str, Tuple[str, bool]] = {}
+        self._published: Optional[DeskState] = None
+        self._published_at = 0.0
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._client.connect()
+        self._client.subscribe(self.command_topic, self._on_command)
+        self._queue(self._discovery_topic, self._discovery, retain=True)
+        Thread.start(self)
+
+    def stop(self):
+        self._running = False
+
+    def _on_command(self, topic: str, payload: str):
+        payload = payload.strip().lower()
+        if payload == "stop":
+            self._worker.request_stop()
+            return
+        try:
+            height = float(payload)
+        except ValueError:
+            height = math.nan
+        if not math.isfinite(height):
+            # float() also accepts "nan" and "inf", which every range check lets through
+            log(f"ignoring MQTT command {payload!r}")
+            return
+        self._worker.move_to_height(height)
+
+    def _queue(self, topic: str, payload: str, retain: bool = False):
+        # a newer message for a topic replaces the one still waiting
+        self._outbox.pop(topic, None)
+        self._outbox[topic] = (payload, retain)
+
+    def _flush(self):
+        for topic, (payload, retain) in list(self._outbox.items()):
+            if not self._client.publish(topic, payload, retain):
+                return
+            del self._outbox[topic]
+
+    def _should_publish(self, state: DeskState, now: float) -> bool:
+        published = self._published
+        return (
+            published is None
+            or now - self._published_at >= self.heartbeat
+            or abs(state.height - published.height) >= self.deadband
+            or state.direction != published.direction
+            or state.target != published.target
+            or state.connected != published.connected
+        )
+
+    def publish_state(self, state: DeskState, now: float):
+        """ Queue the state if it is worth publishing, then send whatever is pending. """
+        if self._should_publish(state, now):
+            self._queue(self.state_topic, json.dumps({
+                "height": round(state.height, 3),
+                "direction": state.direction,
+                "target": state.target,
+                "connected": state.connected,
+            }), retain=True)
+            self._published = state
+            self._published_at = now
+        if self._outbox:
+            self._flush()
+
+    def run(self):
+        version = -1
+        while self._running:
+            state = self._worker.wait_for_state(version, timeout=1.0)
+            version = state.version
+            self.publish_state(state, time.monotonic())
+        self._client.disconnect()
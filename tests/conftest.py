@@ -0,0 +1,47 @@
+import os
+import sys
+import time
+
+import pytest
+
+# the application folder is not a package, import its modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "idasen-ui"))
+
+from idasen_desk import DeskWorkerThread  # noqa: E402
+from idasen_desk import SimulatedClient  # noqa: E402
+
+MAC = "AA:AA:AA:AA:AA:AA"
+
+
+def wait_until(condition, timeout: float = 10.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def fast_desk(**kwargs) -> SimulatedClient:
+    """ Simulated desk moving quickly enough for tests to stay short. """
+    settings = {"speed": 0.08, "latency": 0.1, "coast": 0.0, "round_trip": 0.005}
+    settings.update(kwargs)
+    return SimulatedClient(**settings)
+
+
+@pytest.fixture
+def simulated_desk():
+    return fast_desk()
+
+
+@pytest.fixture
+def worker(simulated_desk):
+    """ Running desk worker driving a simulated desk. """
+    worker = DeskWorkerThread()
+    assert worker.connect(MAC, client=simulated_desk)
+    worker.start_running_loop()
+    assert wait_until(lambda: worker.state.height > 0)
+    yield worker
+    worker.stop_running_loop()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from conftest import MAC
+from conftest import fast_desk
+from conftest import wait_until
+from idasen_desk import DeskState
+from idasen_desk import IdasenDesk
+
+
+def test_refused_or_preempted_claims_do_not_write():
+    client = fast_desk()
+    desk = IdasenDesk(MAC, client=client)
+
+    async def scenario():
+        await desk.move_up(None)
+        preset = desk.acquire_motion("preset", desk.PRIORITY_PRESET)
+        manual = desk.acquire_motion("manual", desk.PRIORITY_MANUAL)
+        await desk.move_up(preset)
+        assert desk.acquire_motion("preset", desk.PRIORITY_PRESET) is None
+        assert client.commands == 0
+        await desk.move_up(manual)
+        await desk.move_up()
+        assert client.commands == 2
+
+    asyncio.run(scenario())
+
+
+def test_claims_follow_priorities():
+    desk = IdasenDesk(MAC, client=fast_desk())
+    schedule = desk.acquire_motion("schedule", desk.PRIORITY_SCHEDULE)
+    preset = desk.acquire_motion("preset", desk.PRIORITY_PRESET)
+    assert schedule.cancelled and not preset.cancelled
+    assert desk.check_preempted(schedule)
+    assert len(desk.preemption_latencies) == 1
+    desk.release_motion(schedule)
+    assert desk.motion_owner == "preset"
+    desk.release_motion(preset)
+    assert desk.motion_owner is None
+
+
+def test_refused_manual_move_writes_nothing(worker, simulated_desk):
+    desk = worker.idasen_desk
+    blocker = desk.acquire_motion("test", desk.PRIORITY_STOP)
+    commands = simulated_desk.commands
+    worker.manual_direction = DeskState.UP
+    time.sleep(0.3)
+    assert simulated_desk.commands == commands
+    worker.manual_direction = DeskState.IDLE
+    time.sleep(0.1)
+    assert simulated_desk.commands == commands
+    assert worker.state.direction == DeskState.IDLE
+    desk.release_motion(blocker)
+
+
+def test_new_preset_replaces_the_running_one(worker, simulated_desk):
+    worker.move_to_height(0.95)
+    assert wait_until(lambda: simulated_desk.height > 0.82)
+    worker.move_to_height(0.72)
+    assert wait_until(lambda: abs(simulated_desk.height - 0.72) < 0.01)
+    assert wait_until(lambda: worker.state.direction == DeskState.IDLE)
+    time.sleep(0.3)
+    assert abs(simulated_desk.height - 0.72) < 0.01
+
+
+def test_preset_burst_keeps_the_last_one(worker, simulated_desk):
+    for target in (0.9, 0.7, 0.95, 0.75):
+        worker.move_to_height(target)
+    assert wait_until(lambda: abs(simulated_desk.height - 0.75) < 0.01)
+    assert wait_until(lambda: worker.state.direction == DeskState.IDLE)
+    assert worker.idasen_desk.motion_owner is None
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+from conftest import MAC
+from conftest import fast_desk
+from conftest import wait_until
+from idasen_desk import DeskCalibration
+from idasen_desk import DeskState
+from idasen_desk import DeskWorkerThread
+
+
+def test_first_observation_replaces_the_defaults():
+    calibration = DeskCalibration()
+    assert calibration.observe(DeskState.UP, latency=0.4, speed=0.04, coast=0.008)
+    assert calibration.up_coast == pytest.approx(0.008)
+    assert calibration.observe(DeskState.UP, latency=0.4, speed=0.04, coast=0.018)
+    assert calibration.up_coast == pytest.approx(0.008 + DeskCalibration.LEARNING_RATE * 0.01)
+    assert calibration.down_samples == 0 and calibration.up_samples == 2
+
+
+@pytest.mark.parametrize("latency, speed, coast", [(0.4, 0.0, 0.01), (0.4, 0.5, 0.01), (5.0, 0.04, 0.01), (0.4, 0.04, 0.2)])
+def test_implausible_observations_are_ignored(latency, speed, coast):
+    calibration = DeskCalibration()
+    assert not calibration.observe(DeskState.DOWN, latency, speed, coast)
+    assert calibration.to_config() == DeskCalibration().to_config()
+
+
+def test_config_round_trip():
+    calibration = DeskCalibration(up_speed=0.04, down_coast=0.01, down_samples=3)
+    config = calibration.to_config()
+    config["unknown"] = 1
+    assert DeskCalibration.from_config(config).to_config() == calibration.to_config()
+
+
+def calibrated_worker(client, saved):
+    worker = DeskWorkerThread(save_calibration=saved.__setitem__)
+    worker.connect(MAC, client=client)
+    worker.start_running_loop()
+    assert wait_until(lambda: worker.state.height > 0)
+    return worker
+
+
+def test_calibration_goes_there_and_back(simulated_desk):
+    saved = {}
+    worker = calibrated_worker(simulated_desk, saved)
+    try:
+        worker.calibrate(0.1)
+        assert wait_until(lambda: len(worker.move_stats) == 2, timeout=15)
+        assert [target for target, error, commands in worker.move_stats] == pytest.approx([0.9, 0.8])
+        assert simulated_desk.height == pytest.approx(0.8, abs=0.006)
+        assert saved[MAC]["up_samples"] == 1 and saved[MAC]["down_samples"] == 1
+        assert wait_until(lambda: worker.idasen_desk.motion_owner is None)
+    finally:
+        worker.stop_running_loop()
+        worker.join(timeout=5)
+
+
+def test_calibration_returns_without_observing_any_motion():
+    client = fast_desk(speed=0.0)
+    saved = {}
+    worker = calibrated_worker(client, saved)
+    worker.idasen_desk.STALL_TIMEOUT = 0.3
+    try:
+        worker.calibrate(0.1)
+        assert wait_until(lambda: len(worker.move_stats) == 2, timeout=15)
+        assert [target for target, error, commands in worker.move_stats] == pytest.approx([0.9, 0.8])
+        assert saved == {}
+    finally:
+        worker.stop_running_loop()
+        worker.join(timeout=5)
+
+
+def test_calibration_starts_from_a_fresh_height(simulated_desk):
+    worker = calibrated_worker(simulated_desk, {})
+    try:
+        # moved with the desk switch while polling was paused
+        worker.pause()
+        simulated_desk.height = 0.9
+        time.sleep(worker.idasen_desk.height_filter.max_age)
+        assert worker.state.height == pytest.approx(0.8)
+        worker.calibrate(0.1)
+        assert wait_until(lambda: len(worker.move_stats) == 2, timeout=15)
+        assert [target for target, error, commands in worker.move_stats] == pytest.approx([1.0, 0.9])
+    finally:
+        worker.stop_running_loop()
+        worker.join(timeout=5)
+
+
+def test_manual_move_aborts_the_calibration(simulated_desk):
+    worker = calibrated_worker(simulated_desk, {})
+    try:
+        worker.calibrate(0.1)
+        assert wait_until(lambda: simulated_desk.height > 0.84)
+        worker.manual_direction = DeskState.DOWN
+        assert wait_until(lambda: simulated_desk.height < 0.82)
+        worker.manual_direction = DeskState.IDLE
+        assert wait_until(lambda: worker.state.direction == DeskState.IDLE)
+        stopped = simulated_desk.height
+        assert not wait_until(lambda: abs(simulated_desk.height - stopped) > 0.005, timeout=1.0)
+        assert not worker.move_stats
+    finally:
+        worker.stop_running_loop()
+        worker.join(timeout=5)
+
+
+def test_calibration_reduces_the_overshoot():
+    # coasting further than the stop tolerance
+    client = fast_desk(coast=0.02)
+    worker = calibrated_worker(client, {})
+    try:
+        worker.move_to_height(0.9)
+        assert wait_until(lambda: len(worker.move_stats) == 1)
+        worker.calibrate(0.1)
+        assert wait_until(lambda: len(worker.move_stats) == 3, timeout=15)
+        worker.move_to_height(0.8)
+        assert wait_until(lambda: len(worker.move_stats) == 4)
+        before = abs(worker.move_stats[0][1])
+        after = abs(worker.move_stats[3][1])
+        assert before > 0.01
+        assert after < before / 2
+    finally:
+        worker.stop_running_loop()
+        worker.join(timeout=5)
@@ -0,0 +1,112 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("voluptuous")
+yaml = pytest.importorskip("yaml")
+
+import idasen_config  # noqa: E402
+from idasen_config import CONFIG_VERSION  # noqa: E402
+from idasen_config import DEFAULT_CONFIG  # noqa: E402
+from idasen_config import load_config  # noqa: E402
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "idasen-ui.yaml")
+
+
+@pytest.fixture
+def errors(monkeypatch):
+    messages = []
+    monkeypatch.setattr(idasen_config, "_error_reporter", messages.append)
+    return messages
+
+
+@pytest.fixture
+def saves(monkeypatch):
+    calls = []
+    save_config = idasen_config.save_config
+
+    def counting_save_config(config, path=idasen_config.CONFIG_PATH):
+        calls.append(path)
+        save_config(config, path)
+
+    monkeypatch.setattr(idasen_config, "save_config", counting_save_config)
+    return calls
+
+
+def write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_old_file_is_migrated_and_saved_once(path, saves, errors):
+    write(path, "mac_address: 'AA:BB:CC:DD:EE:FF'\npositions: {pos1: 0.75, pos2: 1.05}\n")
+    config = load_config(path)
+    assert config["version"] == CONFIG_VERSION
+    assert config["profiling"] == 0 and config["mqtt_broker"] == ""
+    assert config["positions"] == {"pos1": 0.75, "pos2": 1.05}
+    assert saves == [path]
+    assert load_config(path) == config
+    assert saves == [path]
+    assert not errors
+
+
+def test_bad_value_is_reported_and_reset_alone(path, errors):
+    write(path, f"version: {CONFIG_VERSION}\npositions: {{pos1: 5.0, pos2: 1.0}}\nunknown: 1\n")
+    config = load_config(path)
+    assert config["positions"] == {"pos1": DEFAULT_CONFIG["positions"]["pos1"], "pos2": 1.0}
+    assert "unknown" not in config
+    assert len(errors) == 2
+    with open(path) as f:
+        assert yaml.safe_load(f) == config
+
+
+def test_bad_calibration_entry_is_dropped(path, errors):
+    write(path, f"version: {CONFIG_VERSION}\ncalibration: {{'AA:BB': {{up_speed: 0.04, down_speed: fast}}}}\n")
+    config = load_config(path)
+    assert config["calibration"] == {"AA:BB": {"up_speed": 0.04}}
+    assert len(errors) == 1
+
+
+def test_unreadable_yaml_is_kept(path, saves, errors):
+    write(path, "positions: [pos1\n")
+    config = load_config(path)
+    assert config == DEFAULT_CONFIG
+    with open(path + ".bad") as f:
+        assert f.read() == "positions: [pos1\n"
+    assert saves == [path]
+    assert ".bad" in errors[0]
+
+
+def test_valid_cache_skips_the_yaml_import(path, monkeypatch):
+    write(path, "mac_address: 'AA:BB:CC:DD:EE:FF'\n")
+    config = load_config(path)
+    # importing yaml now fails
+    monkeypatch.setitem(sys.modules, "yaml", None)
+    assert load_config(path) == config
+
+
+def test_changed_file_is_read_again(path):
+    config = load_config(path)
+    config["always_on_top"] = 1
+    idasen_config.save_config(config, path)
+    with open(path, "a") as f:
+        f.write("\n")
+    assert load_config(path)["always_on_top"] == 1
+
+
+def test_failed_save_keeps_the_file(path, monkeypatch):
+    config = load_config(path)
+
+    def fail(*args, **kwargs):
+        raise yaml.YAMLError("cannot represent")
+
+    monkeypatch.setattr(yaml, "dump", fail)
+    with pytest.raises(yaml.YAMLError):
+        idasen_config.save_config(dict(config, always_on_top=1), path)
+    assert sorted(os.listdir(os.path.dirname(path))) == ["idasen-ui.cache", "idasen-ui.yaml"]
+    monkeypatch.undo()
+    assert load_config(path) == config
@@ -0,0 +1,31 @@
+import pytest
+
+from idasen_desk import HeightFilter
+
+
+def test_median_rejects_a_single_noisy_sample():
+    height_filter = HeightFilter()
+    for timestamp, raw in enumerate([0.8, 0.8, 1.2, 0.8]):
+        height = height_filter.update(raw, timestamp * 0.1)
+    assert height == pytest.approx(0.8)
+    assert height_filter.velocity == 0.0
+
+
+def test_samples_out_of_range_or_order_are_dropped():
+    height_filter = HeightFilter()
+    height_filter.update(0.8, 1.0)
+    assert height_filter.update(2.0, 1.1) == pytest.approx(0.8)
+    assert height_filter.update(0.9, 0.9) == pytest.approx(0.8)
+    assert height_filter.timestamp == 1.0
+
+
+def test_stale_filter_restarts_on_the_next_sample():
+    height_filter = HeightFilter(max_age=1.5)
+    assert height_filter.is_stale(0.0)
+    height_filter.update(0.8, 1.0)
+    height_filter.update(0.8, 1.1)
+    assert not height_filter.is_stale(2.5)
+    assert height_filter.is_stale(2.7)
+    # a median would keep 0.8, the history no longer describes the desk
+    assert height_filter.update(1.0, 2.7) == pytest.approx(1.0)
+    assert height_filter.velocity == 0.0
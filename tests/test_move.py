@@ -0,0 +1,190 @@
+import asyncio
+import math
+
+import pytest
+
+from conftest import MAC
+from conftest import fast_desk
+from idasen_desk import DeskWorkerThread
+from idasen_desk import IdasenDesk
+from idasen_desk import SimulatedClient
+from idasen_desk import _COMMAND_DOWN
+from idasen_desk import _COMMAND_UP
+
+
+def run_move(client, target, timeout=None, during=None, **desk_settings):
+    """ Move a desk driven by ``client``, ``during(desk, move)`` runs once it moves. """
+    desk = IdasenDesk(MAC, client=client)
+    for name, value in desk_settings.items():
+        setattr(desk, name, value)
+
+    async def scenario():
+        move = desk.move_to_target(target, timeout=timeout)
+        if during is not None:
+            await asyncio.sleep(0.3)
+            await during(desk, move)
+        return await move
+
+    return desk, asyncio.run(scenario())
+
+
+def test_reached():
+    client = fast_desk()
+    desk, result = run_move(client, 0.9)
+    assert result.reason == "reached" and result
+    assert abs(result.error) < 0.006
+    assert abs(client.height - result.height) < 0.001
+    assert desk.motion_owner is None
+    # one command per second of travel or so, not one per sample
+    assert result.commands < result.samples / 2
+
+
+def test_reached_learns_the_desk():
+    client = fast_desk(coast=0.01)
+    desk, result = run_move(client, 0.72)
+    assert result.calibrated
+    assert desk.calibration.down_samples == 1
+    assert desk.calibration.down_coast == pytest.approx(0.01, abs=0.002)
+    assert desk.calibration.down_speed == pytest.approx(0.08, rel=0.2)
+
+
+def test_cancelled():
+    async def cancel(desk, move):
+        move.cancel()
+
+    client = fast_desk()
+    desk, result = run_move(client, 1.2, during=cancel)
+    assert result.reason == "cancelled" and not result
+    stopped = client.height
+    assert 0.8 < stopped < 1.0
+    assert desk.motion_owner is None
+    asyncio.run(asyncio.sleep(0.2))
+    assert client.height == stopped
+
+
+def test_timeout():
+    client = fast_desk()
+    desk, result = run_move(client, 1.2, timeout=0.5)
+    assert result.reason == "timeout"
+    assert 0.4 < result.duration < 1.0
+    assert client.height < 1.0
+
+
+def test_preempted():
+    async def preempt(desk, move):
+        claim = desk.acquire_motion("manual", desk.PRIORITY_MANUAL)
+        await asyncio.sleep(0.1)
+        assert desk.motion_owner == "manual"
+        desk.release_motion(claim)
+
+    client = fast_desk()
+    desk, result = run_move(client, 1.2, during=preempt)
+    assert result.reason == "preempted"
+    assert len(desk.preemption_latencies) == 1
+    assert desk.preemption_latencies[0] < desk.MAX_PREEMPTION_LATENCY
+
+
+def test_stalled():
+    client = fast_desk(speed=0.0)
+    desk, result = run_move(client, 1.0, STALL_TIMEOUT=0.5)
+    assert result.reason == "stalled"
+    assert result.commands >= 1
+    assert result.height == pytest.approx(0.8)
+
+
+def test_refused():
+    client = fast_desk()
+    desk = IdasenDesk(MAC, client=client)
+    desk.acquire_motion("stop", desk.PRIORITY_STOP)
+
+    async def scenario():
+        return await desk.move_to_target(1.0)
+
+    result = asyncio.run(scenario())
+    assert result.reason == "refused"
+    assert client.commands == 0
+
+
+def test_progress_events():
+    desk = IdasenDesk(MAC, client=fast_desk())
+
+    async def scenario():
+        move = desk.move_to_target(0.9)
+        heights = [progress.height async for progress in move]
+        return heights, await move
+
+    heights, result = asyncio.run(scenario())
+    assert result.reached
+    assert heights[-1] > heights[0]
+    assert all(later >= earlier - 1e-6 for earlier, later in zip(heights, heights[1:]))
+
+
+def test_slow_progress_consumer_only_misses_intermediate_heights():
+    desk = IdasenDesk(MAC, client=fast_desk())
+
+    async def scenario():
+        move = desk.move_to_target(0.9)
+        await asyncio.sleep(1.0)
+        heights = [progress.height async for progress in move]
+        return heights, await move
+
+    heights, result = asyncio.run(scenario())
+    assert result.reached
+    # the events of the first second were dropped, the queue only kept the last ones
+    assert heights[0] > 0.83
+    assert heights[-1] == pytest.approx(result.height, abs=0.006)
+
+
+def test_event_loop_shutdown_stops_the_desk():
+    client = fast_desk()
+    desk = IdasenDesk(MAC, client=client)
+
+    async def scenario():
+        move = desk.move_to_target(1.2)
+        await asyncio.sleep(0.3)
+        move._task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await move
+
+    asyncio.run(scenario())
+    stopped = client.height
+    asyncio.run(asyncio.sleep(0.2))
+    assert client.height == stopped
+
+
+def test_first_command_follows_a_fresh_height():
+    class RecordingDesk(SimulatedClient):
+        async def write_gatt_char(self, uuid, data, response=False):
+            self.written.append(bytes(data))
+            await super().write_gatt_char(uuid, data, response)
+
+    client = RecordingDesk(speed=0.08, latency=0.1, coast=0.0, round_trip=0.005)
+    client.written = []
+    desk = IdasenDesk(MAC, client=client)
+
+    async def scenario():
+        await desk.get_filtered_height()
+        await desk.get_filtered_height()
+        # moved with the desk switch since the last poll
+        client.height = 1.0
+        return await desk.move_to_target(0.9)
+
+    result = asyncio.run(scenario())
+    assert result.reason == "reached"
+    assert client.written[0] == bytes(_COMMAND_DOWN)
+    assert bytes(_COMMAND_UP) not in client.written
+
+
+@pytest.mark.parametrize("target", [math.nan, math.inf, -math.inf])
+def test_non_finite_targets_are_refused(target):
+    desk = IdasenDesk(MAC, client=fast_desk())
+    with pytest.raises(ValueError):
+        desk.move_to_target(target)
+    worker = DeskWorkerThread()
+    try:
+        worker.connect(MAC, client=fast_desk())
+        worker.move_to_height(target)
+        assert worker.idasen_desk.motion_owner is None
+    finally:
+        # never started, the loop connect() ran on is left to close
+        worker._loop.close()
@@ -0,0 +1,140 @@
+import json
+import time
+
+import pytest
+
+from conftest import MAC
+from conftest import fast_desk
+from conftest import wait_until
+from idasen_desk import DeskState
+from idasen_desk import IdasenDesk
+from mqtt_bridge import LocalBroker
+from mqtt_bridge import MqttBridge
+
+
+class RecordingWorker:
+    """ Stands in for the desk worker, recording the commands it receives. """
+
+    def __init__(self):
+        self.idasen_desk = IdasenDesk(MAC, client=fast_desk())
+        self.state = DeskState(height=0.8, connected=True, version=1)
+        self.moves = []
+        self.stops = 0
+
+    def wait_for_state(self, version, timeout=None):
+        time.sleep(0.01)
+        return self.state
+
+    def move_to_height(self, height):
+        self.moves.append(height)
+
+    def request_stop(self):
+        self.stops += 1
+
+
+@pytest.fixture
+def recording_worker():
+    return RecordingWorker()
+
+
+@pytest.fixture
+def broker():
+    return LocalBroker()
+
+
+@pytest.fixture
+def bridge(recording_worker, broker):
+    bridge = MqttBridge(recording_worker, broker)
+    bridge.start()
+    yield bridge
+    bridge.stop()
+    bridge.join(timeout=5)
+
+
+def test_commands_are_parsed(bridge, broker, recording_worker):
+    broker.publish(bridge.command_topic, "0.9")
+    broker.publish(bridge.command_topic, " STOP ")
+    broker.publish(bridge.command_topic, "1.05\n")
+    assert recording_worker.moves == [0.9, 1.05]
+    assert recording_worker.stops == 1
+
+
+@pytest.mark.parametrize("payload", ["nan", "NaN", "inf", "-inf", "up", ""])
+def test_invalid_commands_are_ignored(bridge, broker, recording_worker, payload):
+    broker.publish(bridge.command_topic, payload)
+    assert recording_worker.moves == []
+    assert recording_worker.stops == 0
+
+
+def state_messages(broker, bridge):
+    return [json.loads(payload) for topic, payload, retain in broker.messages if topic == bridge.state_topic]
+
+
+@pytest.fixture
+def idle_bridge(recording_worker, broker):
+    # not started, the tests drive publish_state with their own clock
+    broker.connect()
+    return MqttBridge(recording_worker, broker, deadband=0.005, heartbeat=60.0)
+
+
+def test_start_announces_the_sensor(bridge, broker):
+    assert wait_until(lambda: bridge.state_topic in broker.retained)
+    discovery = [topic for topic in broker.retained if topic.startswith("homeassistant/")]
+    assert len(discovery) == 1
+    assert json.loads(broker.retained[discovery[0]])["state_topic"] == bridge.state_topic
+    assert bridge.state_topic == "idasen/aaaaaaaaaaaa/state"
+
+
+def test_deadband(idle_bridge, broker):
+    state = DeskState(height=0.8, connected=True, version=1)
+    idle_bridge.publish_state(state, 0.0)
+    idle_bridge.publish_state(state.replace(height=0.803), 1.0)
+    idle_bridge.publish_state(state.replace(height=0.797), 2.0)
+    assert [message["height"] for message in state_messages(broker, idle_bridge)] == [0.8]
+    idle_bridge.publish_state(state.replace(height=0.806), 3.0)
+    idle_bridge.publish_state(state.replace(height=0.806, direction=DeskState.UP), 3.5)
+    idle_bridge.publish_state(state.replace(height=0.807, direction=DeskState.UP, target=1.1), 4.0)
+    messages = state_messages(broker, idle_bridge)
+    assert [message["height"] for message in messages] == [0.8, 0.806, 0.806, 0.807]
+    assert messages[-1] == {"height": 0.807, "direction": 1, "target": 1.1, "connected": True}
+    assert json.loads(broker.retained[idle_bridge.state_topic]) == messages[-1]
+
+
+def test_heartbeat(idle_bridge, broker):
+    state = DeskState(height=0.8, connected=True, version=1)
+    idle_bridge.publish_state(state, 0.0)
+    idle_bridge.publish_state(state, 59.9)
+    assert len(state_messages(broker, idle_bridge)) == 1
+    idle_bridge.publish_state(state, 60.0)
+    idle_bridge.publish_state(state, 61.0)
+    assert len(state_messages(broker, idle_bridge)) == 2
+
+
+def test_outbox_keeps_the_latest_state_while_disconnected(idle_bridge, broker):
+    state = DeskState(height=0.8, connected=True, version=1)
+    idle_bridge.publish_state(state, 0.0)
+    broker.disconnect()
+    for step, height in enumerate((0.85, 0.9, 0.95)):
+        idle_bridge.publish_state(state.replace(height=height), 1.0 + step)
+    assert len(state_messages(broker, idle_bridge)) == 1
+    broker.connect()
+    # nothing new to report, the pending message still goes out
+    idle_bridge.publish_state(state.replace(height=0.95), 4.0)
+    messages = state_messages(broker, idle_bridge)
+    assert [message["height"] for message in messages] == [0.8, 0.95]
+    idle_bridge.publish_state(state.replace(height=0.95), 5.0)
+    assert len(state_messages(broker, idle_bridge)) == 2
+
+
+def test_bridge_follows_the_worker(worker, simulated_desk, broker):
+    bridge = MqttBridge(worker, broker)
+    bridge.start()
+    try:
+        assert wait_until(lambda: state_messages(broker, bridge))
+        broker.publish(bridge.command_topic, "0.9")
+        assert wait_until(lambda: any(message["target"] == 0.9 for message in state_messages(broker, bridge)))
+        assert wait_until(lambda: state_messages(broker, bridge)[-1]["direction"] == DeskState.IDLE)
+        assert abs(state_messages(broker, bridge)[-1]["height"] - 0.9) < 0.01
+    finally:
+        bridge.stop()
+        bridge.join(timeout=5)
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from conftest import MAC
+from conftest import wait_until
+from form_presenter import DeskFormPresenter
+from idasen_desk import DeskState
+
+
+def make_presenter(desk, positions=None):
+    positions = positions if positions is not None else {"pos1": 0.72, "pos2": 0.9}
+    saved = {}
+
+    def save_position(name, height):
+        saved[name] = height
+        positions[name] = height
+
+    presenter = DeskFormPresenter(desk, positions.__getitem__, save_position)
+    return presenter, saved
+
+
+def test_starts_disconnected(worker):
+    presenter, _ = make_presenter(worker)
+    assert presenter.widget("bluetooth") == {"bitmap": "bt-nc.png", "enabled": True}
+    assert presenter.widget("height") == {"label": "N/A", "enabled": False}
+    for name in ("up", "down", "pos1", "pos2", "memory"):
+        assert presenter.widget(name)["enabled"] is False
+
+
+def test_only_changes_are_returned(worker):
+    presenter, _ = make_presenter(worker)
+    changes = presenter.connected_changed(True)
+    assert changes["bluetooth"] == {"bitmap": "bt.png", "enabled": False}
+    assert changes["up"] == {"bitmap": "up.png", "enabled": True}
+    assert "height" not in changes
+    assert presenter.connected_changed(True) == {}
+    assert presenter.height_changed(worker.state.height) == {"height": {"label": "0.80"}}
+
+
+def test_position_moves_the_desk(worker, simulated_desk):
+    presenter, _ = make_presenter(worker)
+    presenter.connected_changed(True)
+    presenter.position_pressed("pos1")
+    assert wait_until(lambda: abs(simulated_desk.height - 0.72) < 0.01)
+    assert wait_until(lambda: worker.state.direction == DeskState.IDLE)
+    assert abs(worker.state.height - 0.72) < 0.01
+
+
+def test_memory_mode_saves_current_height(worker):
+    presenter, saved = make_presenter(worker)
+    presenter.connected_changed(True)
+    changes = presenter.memory_pressed()
+    assert changes["pos1"] == {"bitmap": "pos1-h.png"}
+    assert changes["up"] == {"enabled": False}
+    changes = presenter.position_pressed("pos2")
+    assert saved == {"pos2": worker.state.height}
+    assert changes["pos2"] == {"bitmap": "pos2.png"}
+    assert presenter.memory_mode is False
+    assert worker.state.target is None
+
+
+def test_memory_mode_saves_a_fresh_height(worker, simulated_desk):
+    # idle polling stopped long ago, then the desk was moved with its switch
+    worker.pause()
+    time.sleep(worker.idasen_desk.height_filter.max_age)
+    simulated_desk.height = 1.05
+    presenter, saved = make_presenter(worker)
+    presenter.connected_changed(True)
+    presenter.memory_pressed()
+    presenter.position_pressed("pos1")
+    assert saved["pos1"] == pytest.approx(1.05, abs=0.001)
+
+
+def test_manual_buttons(worker, simulated_desk):
+    presenter, _ = make_presenter(worker)
+    presenter.manual_pressed(DeskState.UP)
+    assert worker.manual_direction == DeskState.IDLE, "ignored while disconnected"
+    presenter.connected_changed(True)
+    presenter.manual_pressed(DeskState.UP)
+    assert wait_until(lambda: simulated_desk.height > 0.82)
+    presenter.manual_released()
+    assert wait_until(lambda: worker.state.direction == DeskState.IDLE)
+    stopped = simulated_desk.height
+    time.sleep(0.3)
+    assert simulated_desk.height == stopped
+
+
+def test_disconnect_resets_the_form(worker):
+    presenter, _ = make_presenter(worker)
+    presenter.connected_changed(True)
+    presenter.height_changed(0.8)
+    presenter.memory_pressed()
+    changes = presenter.connected_changed(False)
+    assert presenter.memory_mode is False
+    assert changes["height"] == {"label": "N/A"}
+    assert changes["pos1"] == {"bitmap": "pos1-nc.png", "enabled": False}
+    assert presenter.position_pressed("pos1") == {}
+    assert worker.idasen_desk.mac == MAC
@@ -0,0 +1,121 @@
+import glob
+import json
+import os
+import pstats
+import sys
+import time
+from threading import Thread
+
+import pytest
+
+from conftest import wait_until
+from idasen_desk import PROFILER
+from idasen_desk import Profiler
+
+
+def busy():
+    return sum(range(1000))
+
+
+def profiles(directory):
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(directory, "*.prof")))
+
+
+def test_disabled_profiler_records_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    profiler = Profiler()
+    profiler.per_thread = True
+    profiler.attach("gui")
+    profiler.detach()
+    profiler.stop()
+    assert not profiler.active
+    assert os.listdir(tmp_path) == []
+
+
+def test_phases_are_written_as_chrome_trace(tmp_path):
+    profiler = Profiler()
+    profiler.start(str(tmp_path))
+    profiler.start(str(tmp_path / "ignored"))
+    with profiler.phase("ui"):
+        time.sleep(0.01)
+
+    def worker():
+        with profiler.phase("ble"):
+            busy()
+
+    thread = Thread(target=worker, name="DeskWorker")
+    thread.start()
+    thread.join()
+    profiler.stop()
+    assert not profiler.active
+    [path] = glob.glob(str(tmp_path / "profile-*-phases.json"))
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    phases = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert set(phases) == {"ui", "ble"}
+    assert phases["ui"]["dur"] >= 10000
+    names = {event["tid"]: event["args"]["name"] for event in events if event["ph"] == "M"}
+    assert names[phases["ble"]["tid"]] == "DeskWorker"
+    assert phases["ui"]["tid"] != phases["ble"]["tid"]
+
+
+def test_attached_threads_get_their_own_profile(tmp_path):
+    profiler = Profiler()
+    profiler.per_thread = True
+    profiler.start(str(tmp_path))
+
+    def worker():
+        profiler.attach("worker")
+        busy()
+        profiler.detach()
+
+    thread = Thread(target=worker)
+    thread.start()
+    thread.join()
+    profiler.attach("gui")
+    profiler.stop()
+    assert [name.rsplit("-", 1)[1] for name in profiles(str(tmp_path))] == ["gui.prof", "worker.prof"]
+    [path] = glob.glob(str(tmp_path / "*-worker.prof"))
+    functions = [function for _, _, function in pstats.Stats(path).stats]
+    assert "busy" in functions
+
+
+@pytest.mark.skipif(sys.version_info < (3, 12), reason="per thread profiles only before Python 3.12")
+def test_one_profile_of_all_threads(tmp_path):
+    profiler = Profiler()
+    assert not profiler.per_thread
+    profiler.start(str(tmp_path))
+    profiler.attach("gui")
+
+    def worker():
+        profiler.attach("worker")
+        busy()
+        profiler.detach()
+
+    thread = Thread(target=worker)
+    thread.start()
+    thread.join()
+    profiler.stop()
+    [name] = profiles(str(tmp_path))
+    assert name.endswith("-all-threads.prof")
+    functions = [function for _, _, function in pstats.Stats(str(tmp_path / name)).stats]
+    assert "busy" in functions
+
+
+def test_worker_joins_the_capture(worker, tmp_path):
+    PROFILER.start(str(tmp_path))
+    try:
+        worker.wake()
+        worker.move_to_height(0.85)
+        assert wait_until(lambda: len(worker.move_stats) == 1)
+    finally:
+        PROFILER.stop()
+    worker.wake()
+    if PROFILER.per_thread:
+        assert wait_until(lambda: glob.glob(str(tmp_path / "*-worker.prof")))
+    else:
+        assert glob.glob(str(tmp_path / "*-all-threads.prof"))
+    [path] = glob.glob(str(tmp_path / "profile-*-phases.json"))
+    with open(path) as f:
+        phases = {event["name"] for event in json.load(f)["traceEvents"] if event["ph"] == "X"}
+    assert {"ble", "sleep"} <= phases
@@ -0,0 +1,54 @@
+import time
+from threading import Thread
+
+import pytest
+
+from conftest import MAC
+from conftest import fast_desk
+from idasen_desk import DeskState
+from idasen_desk import DeskWorkerThread
+
+
+def test_snapshot_cannot_be_modified():
+    state = DeskState(height=0.8)
+    with pytest.raises(AttributeError):
+        state.height = 1.0
+    moved = state.replace(height=1.0, direction=DeskState.UP)
+    assert state.height == 0.8 and state.direction == DeskState.IDLE
+    assert moved.height == 1.0 and moved.direction == DeskState.UP
+
+
+def test_every_publish_increases_the_version():
+    worker = DeskWorkerThread()
+    try:
+        assert worker.state.version == 0
+        worker.connect(MAC, client=fast_desk())
+        assert worker.state.connected and worker.state.version == 1
+        first = worker.state
+        worker._publish_height(0.9, 0.0)
+        assert worker.state.version == 2 and worker.state.height == 0.9
+        assert first.height != 0.9
+    finally:
+        worker._loop.close()
+
+
+def test_wait_for_state_wakes_on_a_new_version(worker):
+    worker.pause()
+    version = worker.state.version
+    woken = []
+    waiter = Thread(target=lambda: woken.append(worker.wait_for_state(version, timeout=5.0)))
+    waiter.start()
+    time.sleep(0.1)
+    assert not woken
+    worker.request_stop()
+    waiter.join(timeout=5.0)
+    assert woken and woken[0].version > version
+
+
+def test_wait_for_state_returns_on_timeout(worker):
+    worker.pause()
+    time.sleep(0.2)
+    state = worker.state
+    start = time.monotonic()
+    assert worker.wait_for_state(state.version, timeout=0.2) is state
+    assert time.monotonic() - start >= 0.2
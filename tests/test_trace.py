@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+import pytest
+
+from conftest import MAC
+from conftest import fast_desk
+from idasen_desk import IdasenDesk
+from idasen_desk import ReplayClient
+from idasen_desk import _TRACE_WRITE
+from idasen_desk import read_trace
+
+
+def move(desk, target):
+    async def scenario():
+        async with desk:
+            return await desk.move_to_target(target)
+
+    return asyncio.run(scenario())
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    """ Trace of a move on the simulated desk, with its result. """
+    path = str(tmp_path / "idasen-ui-trace.bin")
+    result = move(IdasenDesk(MAC, client=fast_desk(coast=0.01), trace_path=path), 0.9)
+    assert result.reason == "reached"
+    return path, result
+
+
+def test_trace_records_the_move(recorded):
+    path, result = recorded
+    records = read_trace(path)
+    writes = [payload for seconds, kind, uuid_index, payload in records if kind == _TRACE_WRITE]
+    # the move commands, then the stop
+    assert writes[:result.commands] == [writes[0]] * result.commands
+    assert len(writes) > result.commands
+    assert len(records) - len(writes) == result.samples
+
+
+@pytest.mark.parametrize("speed", [1.0, 4.0, 0.0])
+def test_replay_repeats_the_recorded_move(recorded, speed):
+    # regression check of the control loop against a recorded desk
+    path, result = recorded
+    client = ReplayClient(path, speed=speed)
+    started = time.monotonic()
+    replayed = move(IdasenDesk(MAC, client=client), 0.9)
+    elapsed = time.monotonic() - started
+    # the replay runs in trace time, whatever its speed
+    assert replayed.reason == "reached"
+    assert replayed.height == result.height
+    assert replayed.samples == result.samples
+    assert replayed.duration == pytest.approx(result.duration, abs=0.01)
+    if speed > 1:
+        assert elapsed < result.duration / 2
+    recorded_writes = [payload for seconds, kind, uuid_index, payload in read_trace(path) if kind == _TRACE_WRITE]
+    assert [payload for seconds, uuid, payload in client.writes] == recorded_writes
@@ -0,0 +1,90 @@
+import time
+
+from conftest import MAC
+from conftest import wait_until
+from idasen_desk import DeskState
+from idasen_desk import DeskWorkerThread
+from idasen_desk import SimulatedClient
+
+
+class FailingClient(SimulatedClient):
+    """ Simulated desk whose connection drops when ``fail`` is set. """
+
+    fail = False
+
+    async def read_gatt_char(self, uuid, **kwargs):
+        if self.fail:
+            raise OSError("connection lost")
+        return await SimulatedClient.read_gatt_char(self, uuid, **kwargs)
+
+
+class Window:
+    def __init__(self):
+        self.heights = []
+        self.disconnected = False
+
+    def onHeightChanged(self, height):
+        self.heights.append(height)
+
+    def showDisabledButton(self):
+        self.disconnected = True
+
+
+def test_preset_moves_are_reported_and_learned(simulated_desk):
+    saved = {}
+    window = Window()
+    worker = DeskWorkerThread(window, save_calibration=saved.__setitem__)
+    worker.connect(MAC, client=simulated_desk)
+    worker.start_running_loop()
+    try:
+        worker.move_to_height(0.95)
+        assert wait_until(lambda: worker.move_stats)
+        target, error, commands = worker.move_stats[-1]
+        assert target == 0.95 and abs(error) < 0.006 and commands >= 1
+        assert wait_until(lambda: worker.state.direction == DeskState.IDLE and worker.state.target is None)
+        assert saved[MAC]["up_samples"] == 1
+        assert window.heights[-1] == worker.state.height
+        assert worker.idasen_desk.motion_owner is None
+    finally:
+        worker.stop_running_loop()
+        worker.join(timeout=5)
+
+
+def test_stop_request_ends_the_preset(worker, simulated_desk):
+    worker.move_to_height(1.2)
+    assert wait_until(lambda: simulated_desk.height > 0.85)
+    worker.request_stop()
+    assert wait_until(lambda: worker.state.direction == DeskState.IDLE and worker.state.target is None)
+    stopped = simulated_desk.height
+    assert wait_until(lambda: abs(worker.state.height - stopped) < 0.001)
+    assert simulated_desk.height < 1.0
+    assert not worker.move_stats, "a stopped preset is not a completed move"
+
+
+def test_shutdown_stops_a_moving_desk(simulated_desk):
+    worker = DeskWorkerThread()
+    worker.connect(MAC, client=simulated_desk)
+    worker.start_running_loop()
+    worker.move_to_height(1.2)
+    assert wait_until(lambda: simulated_desk.height > 0.85)
+    worker.stop_running_loop()
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    stopped = simulated_desk.height
+    time.sleep(0.3)
+    assert simulated_desk.height == stopped
+
+
+def test_connection_loss_during_a_preset():
+    client = FailingClient(speed=0.08, latency=0.1, coast=0.0, round_trip=0.005)
+    window = Window()
+    worker = DeskWorkerThread(window)
+    worker.connect(MAC, client=client)
+    worker.start_running_loop()
+    worker.move_to_height(1.2)
+    assert wait_until(lambda: client.height > 0.85)
+    client.fail = True
+    worker.join(timeout=5)
+    assert not worker.is_alive()
+    assert window.disconnected
+    assert worker.state.connected is False